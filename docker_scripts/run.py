@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
+import json
 import os
-import shutil
-from sys import stdout
 import schedule
-import subprocess
 import time
 import tempfile
-import errno
+from concurrent.futures import ThreadPoolExecutor
+from tool_scripts import jellyfin_api
 from tool_scripts import jellyfin_import
+from tool_scripts import profiling
 from tool_scripts import spotify_update_playlist
 from tool_scripts import tsar
 
@@ -35,12 +35,10 @@ def main():
     spotipy_client_id = get_envar("SPOTIPY_CLIENT_ID")
     spotipy_client_secret = get_envar("SPOTIPY_CLIENT_SECRET")
     spotipy_redirect_uri = get_envar("SPOTIPY_REDIRECT_URI")
-    spotify_username = get_envar("SPOTIFY_USERNAME")
-    spotify_playlist_uri = get_envar("SPOTIFY_PLAYLIST_URI")
-    jellyfin_username = get_envar("JELLYFIN_USERNAME")
-    jellyfin_password = get_envar("JELLYFIN_PASSWORD")
     jellyfin_server = get_envar("JELLYFIN_SERVER")
     schedule_frequency = get_envar("SCHEDULE_FREQUENCY")
+    # optional, a json file listing several spotify users to sync in this one process, see README.md
+    config_file = os.environ.get("CONFIG_FILE", "")
 
     # ensure we have the required directories
     jellyfin_library_dir = "/jellyfin"
@@ -50,51 +48,160 @@ def main():
     if not os.path.isdir(jellyfin_library_dir):
         raise ValueError(f"jellyfin library directory does not exist: {jellyfin_library_dir}")
 
-    # ensure we have the required spotipy api cache
-    spotipy_cache = f"/.cache-{spotify_username}"
-    if not os.path.isfile(spotipy_cache):
-        raise ValueError(f"spotipy authentication cache file is not avilable at: {spotipy_cache}")
-
-    # ensure we have the required librespot api cache
-    librespot_cache_dir = f"/librespot_cache_dir"
-    librespot_credentials_json = f"/librespot_cache_dir/credentials.json"
-    if not os.path.isfile(librespot_credentials_json):
-        raise ValueError(f"librespot credentials cache file is not avilable at: {librespot_credentials_json}")
+    if config_file:
+        with open(config_file) as f:
+            tenants = json.load(f)["tenants"]
+        for tenant in tenants:
+            for key in ("spotify_username", "spotify_playlist_uri"):
+                if not tenant.get(key):
+                    raise ValueError(f"every tenant in {config_file} must set {key}: {tenant}")
+            # jellyfin login and librespot cache fall back to the container wide settings
+            # empty values count as unset
+            tenant["jellyfin_username"] = tenant.get("jellyfin_username") or os.environ.get("JELLYFIN_USERNAME", "")
+            tenant["jellyfin_password"] = tenant.get("jellyfin_password") or os.environ.get("JELLYFIN_PASSWORD", "")
+            tenant["librespot_cache_dir"] = tenant.get("librespot_cache_dir") or f"/librespot_cache_dir/{tenant['spotify_username']}"
+            if not tenant["jellyfin_username"] or not tenant["jellyfin_password"]:
+                raise ValueError(f"tenant {tenant['spotify_username']} has no jellyfin login and JELLYFIN_USERNAME/JELLYFIN_PASSWORD are not set")
+    else:
+        tenants = [{"spotify_username": get_envar("SPOTIFY_USERNAME"),
+                    "spotify_playlist_uri": get_envar("SPOTIFY_PLAYLIST_URI"),
+                    "jellyfin_username": get_envar("JELLYFIN_USERNAME"),
+                    "jellyfin_password": get_envar("JELLYFIN_PASSWORD"),
+                    "librespot_cache_dir": "/librespot_cache_dir"}]
+
+    for tenant in tenants:
+        # a single tenant keeps using the import dir directly, several each get their own subdirectory
+        if len(tenants) == 1:
+            tenant["import_dir"] = temp_import_dir
+        else:
+            tenant["import_dir"] = f"{temp_import_dir}/{tenant['spotify_username']}"
+            os.makedirs(tenant["import_dir"], exist_ok=True)
+
+        # ensure we have the required spotipy api cache
+        spotipy_cache = f"/.cache-{tenant['spotify_username']}"
+        if not os.path.isfile(spotipy_cache):
+            raise ValueError(f"spotipy authentication cache file is not avilable at: {spotipy_cache}")
+
+        # ensure we have the required librespot api cache
+        librespot_credentials_json = f"{tenant['librespot_cache_dir']}/credentials.json"
+        if not os.path.isfile(librespot_credentials_json):
+            raise ValueError(f"librespot credentials cache file is not avilable at: {librespot_credentials_json}")
 
     # check required all permissions
     verify_writable(jellyfin_library_dir)
     verify_writable(temp_import_dir)
 
+    # does nothing unless PROFILE_DIR is set
+    profiler = profiling.Profiler.from_env()
+
+    # one login per jellyfin user, kept for the life of the process
+    jelly_clients = {}
+
+    def jelly_for(tenant):
+        if tenant["jellyfin_username"] not in jelly_clients:
+            jelly_clients[tenant["jellyfin_username"]] = jellyfin_api.jellyfin(jellyfin_server,
+                                                                              tenant["jellyfin_username"],
+                                                                              tenant["jellyfin_password"])
+        return jelly_clients[tenant["jellyfin_username"]]
+
+    def for_each_tenant(func):
+        """run func(tenant) for every tenant at once, returns the tenants it failed for"""
+        def attempt(tenant):
+            try:
+                func(tenant)
+                return None
+            except Exception as e:
+                print(f"jellyfin-spotify: failed for spotify user {tenant['spotify_username']}: {e}")
+                return tenant
+        with ThreadPoolExecutor(max_workers=len(tenants)) as pool:
+            return [tenant for tenant in pool.map(attempt, tenants) if tenant is not None]
+
+    def update_spotify_playlist(tenant):
+        print(f"____ jellyfin-spotify: START updating spotify playlist with new songs for {tenant['spotify_username']} _____")
+        spotify_update_playlist.run(playlist_id=tenant["spotify_playlist_uri"], username=tenant["spotify_username"])
+        print(f"____ jellyfin-spotify: FINISHED updating spotify playlist with new songs for {tenant['spotify_username']} _____")
+
     def run_update_spotify_playlist():
-        print("____ jellyfin-spotify: START updating spotify playlist with new songs _____")
-        spotify_update_playlist.run(playlist_id=spotify_playlist_uri, username=spotify_username)
-        print("____ jellyfin-spotify: FINISHED updating spotify playlist with new songs _____")
+        with profiler.stage("update_spotify_playlist"):
+            failed = for_each_tenant(update_spotify_playlist)
+        if failed:
+            raise RuntimeError(f"unable to update spotify playlists for {[tenant['spotify_username'] for tenant in failed]}")
 
     def run_tsar_and_import():
-        # update right before we run tsar to ensure we have all of the latest songs
-        run_update_spotify_playlist()
-        print("____ jellyfin-spotify: START running tsar ____")
-        tsar.run(output_dir=temp_import_dir,
-                  uri=spotify_playlist_uri,
-                  cache_dir=librespot_cache_dir,
-                  username=spotify_username,
-                  librespot_binary="/usr/bin/librespot",
-                  empty_playlist=False)
-        print("____ jellyfin-spotify: FINISHED running tsar ____")
+        with profiler.run("tsar_and_import"):
+            tsar_and_import()
 
+    def tsar_and_import():
+        # update right before we run tsar to ensure we have all of the latest songs
+        with profiler.stage("update_spotify_playlist"):
+            failed = for_each_tenant(update_spotify_playlist)
+
+        # downloads stay one at a time, they are limited by bandwidth rather than waiting on the api
+        downloaded = []
+        for tenant in tenants:
+            if tenant in failed:
+                continue
+            print(f"____ jellyfin-spotify: START running tsar for {tenant['spotify_username']} ____")
+            try:
+                with profiler.stage(f"tsar-{tenant['spotify_username']}"):
+                    tsar.run(output_dir=tenant["import_dir"],
+                              uri=tenant["spotify_playlist_uri"],
+                              cache_dir=tenant["librespot_cache_dir"],
+                              username=tenant["spotify_username"],
+                              librespot_binary="/usr/bin/librespot",
+                              empty_playlist=False)
+            except Exception as e:
+                print(f"jellyfin-spotify: tsar failed for spotify user {tenant['spotify_username']}: {e}")
+                failed.append(tenant)
+                continue
+            downloaded.append(tenant)
+            print(f"____ jellyfin-spotify: FINISHED running tsar for {tenant['spotify_username']} ____")
+
+        # every tenant's songs share one library scan and one id resolution pass. import dirs of tenants whose
+        # download failed are still imported, anything left over from an earlier run is picked up
         print("_____ jellyfin-spotify: START importing new songs into jellyfin ____")
-        jellyfin_import.run(jellyfin_username=jellyfin_username,
-                             jellyfin_password=jellyfin_password,
-                             server=jellyfin_server,
-                             import_dir=temp_import_dir,
-                             jellyfin_library_dir=jellyfin_library_dir,
-                             empty_import_dir=True)
+        playlist_name = jellyfin_import.monthly_playlist_name()
+        jobs = [jellyfin_import.ImportJob(jelly_for(tenant), tenant["import_dir"], playlist_name) for tenant in tenants]
+        with profiler.stage("import"):
+            failed_lookups = jellyfin_import.import_many(jobs,
+                                                         jellyfin_library_dir=jellyfin_library_dir,
+                                                         empty_import_dir=True,
+                                                         # run_retry_lookups picks up the songs jellyfin can't find yet
+                                                         retry_later=True)
         print("_____ jellyfin-spotify: FINISHED importing new songs into jellyfin ____")
 
-        print("_____ jellyfin-spotify: START emptying playlist ____")
-        tsar.empty_playlist(uri=spotify_playlist_uri,
-                            username=spotify_username)
-        print("_____ jellyfin-spotify: FINISHED emptying playlist ____")
+        if failed_lookups:
+            print("Failed the following lookups:")
+            for failed_lookup in failed_lookups:
+                print(failed_lookup)
+            raise ValueError("Failed to add all songs to playlist")
+
+        for tenant in downloaded:
+            print(f"_____ jellyfin-spotify: START emptying playlist for {tenant['spotify_username']} ____")
+            with profiler.stage(f"empty_playlist-{tenant['spotify_username']}"):
+                tsar.empty_playlist(uri=tenant["spotify_playlist_uri"],
+                                    username=tenant["spotify_username"])
+            print(f"_____ jellyfin-spotify: FINISHED emptying playlist for {tenant['spotify_username']} ____")
+
+        if failed:
+            raise RuntimeError(f"unable to sync spotify users {[tenant['spotify_username'] for tenant in failed]}")
+
+    def run_retry_lookups():
+        # songs jellyfin couldn't find during an import, looked up again once their backoff expires
+        # don't raise, that would stop the scheduler over songs that stay queued anyway
+        try:
+            jobs = [jellyfin_import.ImportJob(jelly_for(tenant), tenant["import_dir"], None) for tenant in tenants]
+            with profiler.stage("retry_lookups"):
+                failed_lookups = jellyfin_import.retry_lookups(jobs,
+                                                               jellyfin_library_dir=jellyfin_library_dir,
+                                                               empty_import_dir=True)
+        except Exception as e:
+            print(f"jellyfin-spotify: retrying song lookups failed, trying again tomorrow: {e}")
+            return
+        if failed_lookups:
+            print("Still unable to find the following songs, they keep being retried daily:")
+            for failed_lookup in failed_lookups:
+                print(failed_lookup)
 
     print("____ Running jellyfin-spotify ____")
     print(f"ENVARS: {os.environ}")
@@ -117,6 +224,8 @@ def main():
         schedule.every().hour.do(run_update_spotify_playlist)
         # run off the our to avoid conflicting with the playlist update task
         schedule.every(1).day.at(schedule_frequency).do(run_tsar_and_import)
+        # cheap when nothing is queued, it only reads the import state files
+        schedule.every(jellyfin_import.LOOKUP_RETRY_DELAY // 60).minutes.do(run_retry_lookups)
         while True:
             schedule.run_pending()
             time.sleep(60)
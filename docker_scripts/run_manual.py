@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 import os
 import shutil
-from sys import stdout
-import schedule
-import subprocess
 import time
 import tempfile
-import errno
+from tool_scripts import daemon
+from tool_scripts import file_walker
+from tool_scripts import jellyfin_api
 from tool_scripts import jellyfin_import
+from tool_scripts import library_index
+from tool_scripts import playlist_mirror
+from tool_scripts import profiling
 from tool_scripts import spotify_get_playlist_name
+from tool_scripts.spotify_api import start_api
+from tool_scripts import spotify_ids
 from tool_scripts import validate_spotify_cache
 from tool_scripts import tsar
 
@@ -40,7 +44,17 @@ def main():
     jellyfin_username = get_envar("JELLYFIN_USERNAME")
     jellyfin_password = get_envar("JELLYFIN_PASSWORD")
     jellyfin_server = get_envar("JELLYFIN_SERVER")
-
+    # optional, when set we stay running and take jobs over http on this port instead of exiting
+    daemon_port = os.environ.get("DAEMON_PORT", "")
+    # the api has no authentication, so only listen locally unless told otherwise
+    daemon_bind = os.environ.get("DAEMON_BIND", "") or "127.0.0.1"
+    # optional, how playlist links are synced:
+    #  - unset  : download the whole playlist and add every song to the jellyfin playlist
+    #  - MIRROR : only download and add the tracks the jellyfin playlist is missing
+    #  - MIRROR_REMOVE : like MIRROR, and also remove tracks that were dropped from the spotify playlist
+    playlist_sync = os.environ.get("PLAYLIST_SYNC", "")
+    if playlist_sync not in ("", "MIRROR", "MIRROR_REMOVE"):
+        raise ValueError(f"PLAYLIST_SYNC must be unset, MIRROR or MIRROR_REMOVE, not {playlist_sync}")
 
     # ensure we have the required directories
     jellyfin_library_dir = "/jellyfin"
@@ -65,36 +79,129 @@ def main():
     verify_writable(jellyfin_library_dir)
     verify_writable(temp_import_dir)
 
-    # ensure our cache file works
-    validate_spotify_cache.run(username=spotify_username)
+    # ensure our cache file works, and keep the client so every link reuses it
+    spotify = {"api": validate_spotify_cache.run(username=spotify_username), "started": time.time()}
+
+    def get_spotify():
+        # spotipy is handed a plain access token which expires after an hour, so reconnect well before that
+        if time.time() - spotify["started"] > 45 * 60:
+            spotify["api"] = start_api(spotify_username)
+            spotify["started"] = time.time()
+        return spotify["api"]
+
+    # log in and load the library index and spotify id map once, rather than once per link
+    jelly = jellyfin_api.jellyfin(jellyfin_server, jellyfin_username, jellyfin_password)
+    index = library_index.LibraryIndex(jellyfin_library_dir)
+    id_map = spotify_ids.SpotifyIdMap(jellyfin_library_dir)
+    snapshots = playlist_mirror.SnapshotCache(jellyfin_library_dir)
+    # does nothing unless PROFILE_DIR is set
+    profiler = profiling.Profiler.from_env()
+
+    def run_tsar(uri, output_dir=temp_import_dir):
+        print(f"____ jellyfin-spotify: START running tsar for uri {uri} ____")
+        with profiler.stage("tsar"):
+            tsar.run(output_dir=output_dir,
+                      uri=uri,
+                      cache_dir=librespot_cache_dir,
+                      username=spotify_username,
+                      librespot_binary="/usr/bin/librespot",
+                      empty_playlist=False)
+        print(f"____ jellyfin-spotify: FINISHED running tsar for uri {uri} ____")
+
+    def download_and_import(uris, playlist_name):
+        """download each track or playlist uri then import them all into playlist_name"""
+        download_dirs = []
+        try:
+            for uri in uris:
+                # each download gets its own directory, so finding the files it added doesn't mean walking all of
+                # /import again for every track
+                kind, spotify_id = spotify_ids.parse_spotify_uri(uri)
+                if kind:
+                    download_dir = f"{temp_import_dir}/{kind}_{spotify_id}"
+                else:
+                    # urls carry slashes and query strings, keep the directory name flat
+                    download_dir = f"{temp_import_dir}/" + "".join(c if c.isalnum() or c in "-_" else "_" for c in uri.strip())
+                os.makedirs(download_dir, exist_ok=True)
+                download_dirs.append(download_dir)
+                run_tsar(uri, download_dir)
+                # for a single track we know exactly which track we asked for, record it so the import can match it by id
+                if kind == "track":
+                    for path, _ in file_walker.walk_files(download_dir):
+                        spotify_ids.record_manifest(path, f"spotify:track:{spotify_id}")
+            run_import(playlist_name)
+        finally:
+            # songs that failed to import stay where they are, to be picked up by the next import
+            for download_dir in download_dirs:
+                if next(file_walker.walk_files(download_dir), None) is None:
+                    shutil.rmtree(download_dir, ignore_errors=True)
 
     def run_tsar_and_import(uri):
+        with profiler.run("link"):
+            tsar_and_import(uri)
+
+    def tsar_and_import(uri):
+
+        if "playlist" in uri and playlist_sync:
+            # the sync calls back into run_tsar and run_import, which profile themselves
+            playlist_mirror.sync(spotify_api=get_spotify(),
+                                 jelly=jelly,
+                                 id_map=id_map,
+                                 snapshots=snapshots,
+                                 playlist_uri=uri.strip(),
+                                 download_and_import=download_and_import,
+                                 remove_dropped=playlist_sync == "MIRROR_REMOVE")
+            return
 
         if "playlist" in uri:
-            playlist_name = spotify_get_playlist_name.run(username=spotify_username,
-                                                          playlist_id=uri)
+            playlist_name = spotify_get_playlist_name.get_playlist_name(get_spotify(), uri)
         else:
             playlist_name = None
 
-        print(f"____ jellyfin-spotify: START running tsar for uri {uri} ____")
-        tsar.run(output_dir=temp_import_dir,
-                  uri=uri,
-                  cache_dir=librespot_cache_dir,
-                  username=spotify_username,
-                  librespot_binary="/usr/bin/librespot",
-                  empty_playlist=False)
-        print(f"____ jellyfin-spotify: FINISHED running tsar for uri {uri} ____")
+        run_tsar(uri)
+        run_import(playlist_name, uri)
 
+    def run_import(playlist_name, uri=None):
         print(f"_____ jellyfin-spotify: START importing new songs into jellyfin  for uri {uri}  ____")
-        jellyfin_import.run_manual(jellyfin_username=jellyfin_username,
-                             jellyfin_password=jellyfin_password,
-                             server=jellyfin_server,
-                             import_dir=temp_import_dir,
-                             jellyfin_library_dir=jellyfin_library_dir,
-                             empty_import_dir=True,
-                             playlist_name=playlist_name)
+        with profiler.stage("import"):
+            jellyfin_import.run_manual(jellyfin_username=jellyfin_username,
+                                 jellyfin_password=jellyfin_password,
+                                 server=jellyfin_server,
+                                 import_dir=temp_import_dir,
+                                 jellyfin_library_dir=jellyfin_library_dir,
+                                 empty_import_dir=True,
+                                 playlist_name=playlist_name,
+                                 jelly=jelly,
+                                 index=index,
+                                 id_map=id_map)
         print(f"_____ jellyfin-spotify: FINISHED importing new songs into jellyfin  for uri {uri} ____")
 
+    def remove_link(link):
+        # remove the link from the file now that we have successfully imported it
+        with open("/spotify_links.txt") as spotify_links_file:
+            links = spotify_links_file.readlines()
+        with open("/spotify_links.txt", "w") as spotify_links_file:
+            for unimported_link in links:
+                if unimported_link.strip() != link.strip():
+                    spotify_links_file.write(unimported_link)
+
+    def run_daemon(links):
+        # the spotify and jellyfin clients and the library index stay warm across jobs
+        def run_job(job):
+            if job.kind == "link":
+                run_tsar_and_import(job.uri)
+                remove_link(job.uri)
+            elif job.kind == "import":
+                run_import(playlist_name=None)
+            else:
+                raise ValueError(f"unknown job kind {job.kind}")
+
+        jobs = daemon.JobQueue(run_job)
+        # pick up anything left in the links file from before we started
+        for link in links:
+            if link.strip():
+                jobs.submit("link", link.strip())
+        daemon.serve(jobs, daemon_bind, int(daemon_port))
+
 
     print("____ Running jellyfin-spotify manual____")
     print(f"ENVARS: {os.environ}")
@@ -103,18 +210,12 @@ def main():
     with open("/spotify_links.txt") as spotify_links_file:
         links = spotify_links_file.readlines()
 
-    unimported_links = links
+    if daemon_port:
+        run_daemon(links)
 
     for link in links:
         run_tsar_and_import(link)
-
-        # remove the link from the file now that we have successfully imported it
-        unimported_links.remove(link)
-
-        open("/spotify_links.txt", "w").close()
-        with open("/spotify_links.txt", "r+") as spotify_links_file:
-            for unimported_link in unimported_links:
-                spotify_links_file.write(unimported_link)
+        remove_link(link)
 
 
 
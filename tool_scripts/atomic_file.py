@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    open path for writing as a temporary file next to it, and move it over path once the block completes.
+    a crash mid-write never leaves a truncated file behind, readers see either the old or the new contents
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# measure how long it takes to import each tool, using python's -X importtime
+# run from the repo root: python3 -m tool_scripts.bench_startup
+import subprocess
+import sys
+
+
+MODULES = [
+    "tool_scripts.cli",
+    "tool_scripts.generate_spotipy_cache",
+    "tool_scripts.jellyfin_api",
+    "tool_scripts.jellyfin_import",
+    "tool_scripts.spotify_get_playlist_name",
+    "tool_scripts.spotify_update_playlist",
+    "tool_scripts.validate_spotify_cache",
+]
+
+
+def import_times(module):
+    """returns (total microseconds, [(cumulative microseconds, imported module)]) for a fresh import of module"""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                       capture_output=True, text=True)
+    if r.returncode != 0:
+        raise RuntimeError(f"unable to import {module}: {r.stderr.strip().splitlines()[-1]}")
+    times = []
+    for line in r.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # the package name is indented one space, plus two more for each level of nesting
+        times.append((int(cumulative), name.rstrip()[1:]))
+    total = sum(cumulative for cumulative, name in times if not name.startswith(" "))
+    return total, times
+
+
+def main(runs=5, top=5):
+    for module in MODULES:
+        try:
+            results = [import_times(module) for _ in range(runs)]
+        except RuntimeError as e:
+            print(e)
+            continue
+        best_total, best_times = min(results)
+        print(f"{module}: {best_total / 1000:.1f}ms (best of {runs})")
+        # the slowest imports pulled in by the module are the ones worth making lazy
+        slowest = sorted((t for t in best_times if t[1].startswith(" ")), reverse=True)[:top]
+        for cumulative, name in slowest:
+            print(f"    {cumulative / 1000:8.1f}ms {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import functools
+import json
+import os
+import re
+
+
+# optional, kept in the library root:
+# {"artists": {"<artist>": "<artist dir>"}, "albums": {"<album>": "<album dir>"}, "strip_featuring": false}
+ALIAS_FILE = ".jellyfin_spotify_aliases.json"
+
+# " feat. X", " ft X", " (featuring X)" and friends, through the end of the name
+FEATURING_RE = re.compile(r"\s*[\(\[]?\s*\b(?:feat|ft|featuring)\b\.?\s.*$", re.IGNORECASE)
+
+
+def sanitize_filename(filename):
+    """Takes only a filename, not a full path"""
+    return re.sub('/', ' ', filename).strip()
+
+
+def canonical_artist(track_artist, album_artist):
+    """pick the artist directory from the raw artist and album artist tags"""
+    # multiple artists will look like artist1;artist2;artist3
+    track_artist = sanitize_filename(track_artist.split(";")[0])
+    album_artist = sanitize_filename(album_artist.split(";")[0])
+
+    if album_artist not in track_artist:
+        # if the album artist is generic, just use the track artist
+        if "Various Artists" in album_artist:
+            return track_artist
+        elif "Various Artists" in track_artist:
+            return album_artist
+        elif "Traditional" in album_artist:
+            return track_artist
+        elif "Traditional" in track_artist:
+            return album_artist
+        # if we get here and we have not found an appropriate artist, default to the track artist
+        # track artist is generally the correct artist
+        print(f"picking track artist as canonical artist, track_artist = {track_artist}, album_artist = {album_artist}")
+        return track_artist
+
+    return track_artist
+
+
+def _alias_dirs(aliases):
+    # names are matched regardless of case, against the already sanitized tags. the directory names are used as
+    # written, but must still be a single path component, an alias containing / would otherwise nest directories
+    # or escape the library
+    dirs = {}
+    for name, alias in aliases.items():
+        alias = sanitize_filename(alias)
+        if alias in ("", ".", ".."):
+            print(f"ignoring alias {name!r}, it doesn't name a directory")
+            continue
+        dirs[sanitize_filename(name).casefold()] = alias
+    return dirs
+
+
+@functools.lru_cache(maxsize=8)
+def _load_aliases(alias_path, mtime_ns):
+    with open(alias_path) as f:
+        aliases = json.load(f)
+    return (_alias_dirs(aliases.get("artists", {})),
+            _alias_dirs(aliases.get("albums", {})),
+            bool(aliases.get("strip_featuring", False)))
+
+
+class Canonicalizer:
+    """
+    memoized (artist dir, album dir) for the raw (artist, album artist, album) tags, so every track of an album
+    makes the decision once. the alias table in the library root is applied on top, to merge artist and album names
+    that would otherwise end up in separate directories
+    """
+
+    def __init__(self, library_dir, alias_file=None):
+        self.alias_file = alias_file or f"{library_dir}/{ALIAS_FILE}"
+        self.artists = {}
+        self.albums = {}
+        self.strip_featuring = False
+        self._dirs = {}
+        if os.path.isfile(self.alias_file):
+            try:
+                # keyed on mtime so a long running process picks up edits to the table
+                self.artists, self.albums, self.strip_featuring = _load_aliases(self.alias_file,
+                                                                                 os.stat(self.alias_file).st_mtime_ns)
+            except (OSError, ValueError, AttributeError, TypeError) as e:
+                print(f"unable to load artist and album aliases {self.alias_file}, ignoring them: {e}")
+
+    def artist_dir(self, track_artist, album_artist):
+        if self.strip_featuring:
+            track_artist = FEATURING_RE.sub("", track_artist) or track_artist
+            album_artist = FEATURING_RE.sub("", album_artist) or album_artist
+        artist = canonical_artist(track_artist, album_artist)
+        return self.artists.get(artist.casefold(), artist)
+
+    def album_dir(self, album):
+        album = sanitize_filename(album)
+        return self.albums.get(album.casefold(), album)
+
+    def dirs(self, track_artist, album_artist, album):
+        """returns (artist dir, album dir) for the raw tags"""
+        key = (track_artist, album_artist, album)
+        dirs = self._dirs.get(key)
+        if dirs is None:
+            dirs = self._dirs[key] = (self.artist_dir(track_artist, album_artist), self.album_dir(album))
+        return dirs
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# shared command line entry points. each command imports its tool only when it runs, so the tools themselves
+# never need click and `--help` doesn't load spotipy, requests or eyed3
+import click
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("generate-spotipy-cache")
+@click.option("--username", type=str, required=True, help="username of the user to login as")
+def generate_spotipy_cache(username):
+    """
+    the following must be set:
+    SPOTIPY_CLIENT_ID
+    SPOTIPY_CLIENT_SECRET
+    SPOTIPY_REDIRECT_URI
+    """
+    from . import generate_spotipy_cache
+    generate_spotipy_cache.run(username=username)
+
+
+@cli.command("jellyfin-import")
+@click.option("--jellyfin_username", type=str, required=True, help="username of the user to login as")
+@click.option("--jellyfin_password", type=str, required=True, help="password of the user to login as")
+@click.option("--server", type=str, required=True, help="server url")
+@click.option("--import_dir", type=str, required=True, help="directory to import music from")
+@click.option("--jellyfin_library_dir", type=str, required=True, help="directory to import music to")
+@click.option("--empty_import_dir", is_flag=True, default=False, help="remove all songs from the import_dir when complete")
+def jellyfin_import(jellyfin_username, jellyfin_password, server, import_dir, jellyfin_library_dir, empty_import_dir):
+    from . import jellyfin_import
+    jellyfin_import.run(jellyfin_username=jellyfin_username,
+                        jellyfin_password=jellyfin_password,
+                        server=server,
+                        import_dir=import_dir,
+                        jellyfin_library_dir=jellyfin_library_dir,
+                        empty_import_dir=empty_import_dir)
+
+
+@cli.command("spotify-get-playlist-name")
+@click.option("--playlist_id", type=str, required=True, help="playlist uri to record, of the form spotify:playlist:<rand>")
+@click.option("--username", type=str, required=True, help="username of the user to login as")
+def spotify_get_playlist_name(playlist_id, username):
+    from . import spotify_get_playlist_name
+    print(spotify_get_playlist_name.run(playlist_id=playlist_id, username=username))
+
+
+@cli.command("spotify-update-playlist")
+@click.option("--playlist_id", type=str, required=True, help="playlist uri to record, of the form spotify:playlist:<rand>")
+@click.option("--username", type=str, required=True, help="username of the user to login as")
+def spotify_update_playlist(playlist_id, username):
+    from . import spotify_update_playlist
+    spotify_update_playlist.run(playlist_id=playlist_id, username=username)
+
+
+@cli.command("validate-spotify-cache")
+@click.option("--username", type=str, required=True, help="username of the user to login as")
+def validate_spotify_cache(username):
+    from . import validate_spotify_cache
+    validate_spotify_cache.run(username=username)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import datetime
+import itertools
+import json
+import queue
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def time_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class Job:
+    def __init__(self, job_id, kind, uri=None):
+        self.id = job_id
+        self.kind = kind
+        self.uri = uri
+        self.state = QUEUED
+        self.error = None
+        self.submitted = time_now()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {"id": self.id,
+                "kind": self.kind,
+                "uri": self.uri,
+                "state": self.state,
+                "error": self.error,
+                "submitted": self.submitted,
+                "started": self.started,
+                "finished": self.finished}
+
+
+class JobQueue:
+    """
+    jobs run one at a time on a single worker thread, they all share the same import directory.
+    run_job(job) does the actual work and raises on failure
+    """
+
+    def __init__(self, run_job):
+        self.run_job = run_job
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.ids = itertools.count(1)
+        self.worker = threading.Thread(target=self._work, name="job-worker", daemon=True)
+        self.worker.start()
+
+    def submit(self, kind, uri=None):
+        with self.lock:
+            job = Job(next(self.ids), kind, uri)
+            self.jobs[job.id] = job
+        print(f"queued job {job.id}: {kind} {uri or ''}")
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def all(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.state = RUNNING
+            job.started = time_now()
+            try:
+                self.run_job(job)
+                job.state = DONE
+            except Exception as e:
+                traceback.print_exc()
+                job.state = FAILED
+                job.error = str(e)
+            job.finished = time_now()
+            print(f"job {job.id} {job.state}")
+
+
+def make_handler(jobs):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_links(self):
+            """body is either {"links": [...]} or plain text with one link per line"""
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode()
+            if "application/json" in self.headers.get("Content-Type", ""):
+                data = json.loads(body)
+                links = data.get("links", []) if isinstance(data, dict) else None
+                if not isinstance(links, list) or not all(isinstance(link, str) for link in links):
+                    raise ValueError('expected {"links": ["<link>", ...]}')
+                return [link.strip() for link in links if link.strip()]
+            return [line.strip() for line in body.splitlines() if line.strip()]
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["jobs"]:
+                return self.send_json(200, [job.to_dict() for job in jobs.all()])
+            if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+                job = jobs.get(int(parts[1]))
+                if job is None:
+                    return self.send_json(404, {"error": f"no job {parts[1]}"})
+                return self.send_json(200, job.to_dict())
+            self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            if self.path == "/links":
+                try:
+                    links = self.read_links()
+                except ValueError as e:
+                    return self.send_json(400, {"error": f"unable to parse links: {e}"})
+                if not links:
+                    return self.send_json(400, {"error": "no links given"})
+                return self.send_json(202, [jobs.submit("link", link).to_dict() for link in links])
+            if self.path == "/import":
+                return self.send_json(202, jobs.submit("import").to_dict())
+            self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+        def log_message(self, format, *args):
+            print(f"daemon: {self.address_string()} {format % args}")
+
+    return Handler
+
+
+def serve(jobs, host, port):
+    """
+    POST /links   submit spotify links, either json {"links": [...]} or one link per line
+    POST /import  import whatever is already in the import directory
+    GET  /jobs    status of every job
+    GET  /jobs/ID status of one job
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(jobs))
+    print(f"listening for jobs on {host}:{port}")
+    server.serve_forever()
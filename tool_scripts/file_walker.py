@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import os
+import stat
+
+
+AUDIO_EXTENSIONS = (".mp3",)
+
+
+def scan_dir(path, extensions):
+    """list one directory, returns the matching files as (path, stat) and the subdirectories"""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # skip our own state files and anything else hidden
+                if entry.name.startswith("."):
+                    continue
+                # DirEntry caches its stat result, and on most platforms scandir already filled it in
+                st = entry.stat(follow_symlinks=False)
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append(entry.path)
+                elif stat.S_ISREG(st.st_mode):
+                    if extensions is None or entry.name.lower().endswith(extensions):
+                        files.append((entry.path, st))
+    except FileNotFoundError:
+        # removed while we were walking
+        pass
+    files.sort()
+    return files, subdirs
+
+
+def walk_files(root, extensions=AUDIO_EXTENSIONS, workers=8):
+    """
+    recursively yield (path, stat) for every file under root with one of the given extensions.
+    directories are listed in parallel, which hides the per-directory latency of network filesystems, and files
+    are yielded as soon as their directory has been listed rather than after the whole tree has been walked
+    """
+    # concurrent.futures is slow to import, only load it once we are actually walking
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(scan_dir, root, extensions)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(pool.submit(scan_dir, subdir, extensions))
+                for f in files:
+                    yield f
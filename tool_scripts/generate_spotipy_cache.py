@@ -1,20 +1,18 @@
 #!/usr/bin/env python3
-import spotify_update_playlist
-import click
-import os
+from .spotify_api import start_api
 
-@click.command()
-@click.option("--username", type=str, required=True, help="username of the user to login as")
-def main(username):
+
+def run(username):
     """
     the following must be set:
     SPOTIPY_CLIENT_ID
     SPOTIPY_CLIENT_SECRET
     SPOTIPY_REDIRECT_URI
     """
-    spotify_api = spotify_update_playlist.start_api(username)
+    start_api(username)
     print(f"Created spotipy credental cache file at .cache-{username}")
 
 
 if __name__ == "__main__":
-    main()
+    from .cli import generate_spotipy_cache
+    generate_spotipy_cache()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import requests
+from . import rate_limiter
 import time
 
 
@@ -15,18 +15,30 @@ authorization = (
 )
 headers['x-emby-authorization'] = authorization
 
+# every call to the server goes through the shared jellyfin rate limiter
+_session = None
+
+
+def session():
+    # created on first use so importing this module doesn't pull in requests
+    global _session
+    if _session is None:
+        _session = rate_limiter.session("jellyfin")
+    return _session
+
 
 class jellyfin:
 
     def __init__(self, server_url, username, password):
         self.server_url = server_url
-        self.headers = headers
+        # each login gets its own copy, the token added below is per user
+        self.headers = dict(headers)
         # Build json payload to authenticate to the server
         auth_data = {
             'Username': username,
             'Pw': password
         }
-        r = requests.post(f'{self.server_url}/Users/AuthenticateByName', headers=self.headers, json=auth_data)
+        r = session().post(f'{self.server_url}/Users/AuthenticateByName', headers=self.headers, json=auth_data)
         r.raise_for_status()
 
         token = r.json().get('AccessToken')
@@ -38,16 +50,20 @@ class jellyfin:
 
     ## Basic
     def get(self, endpoint, parameters=None):
-        r = requests.get(f'{self.server_url}/{endpoint}', headers=self.headers, params=parameters)
+        r = session().get(f'{self.server_url}/{endpoint}', headers=self.headers, params=parameters)
         r.raise_for_status()
         return r.json()
 
     def post(self, endpoint, body=None, parameters=None):
-        r = requests.post(f'{self.server_url}/{endpoint}', headers=self.headers, json=body, params=parameters)
+        r = session().post(f'{self.server_url}/{endpoint}', headers=self.headers, json=body, params=parameters)
         r.raise_for_status()
         if 'application/json' in r.headers.get('Content-Type', ''):
             return r.json()
 
+    def delete(self, endpoint, parameters=None):
+        r = session().delete(f'{self.server_url}/{endpoint}', headers=self.headers, params=parameters)
+        r.raise_for_status()
+
     ## Specific
     def lookup_playlist_id(self, playlist_name):
         # example of how to handle query parameters
@@ -58,11 +74,25 @@ class jellyfin:
             if playlist["Name"] == playlist_name:
                 return playlist["ItemId"]
 
-    def lookup_playlist_items(self, playlist_id):
+    def lookup_playlist_items(self, playlist_id, start_index=None, limit=None):
         endpoint = f"Playlists/{playlist_id}/Items"
         parameters = {"userId" : self.user_id}
+        if start_index is not None:
+            parameters["startIndex"] = start_index
+        if limit is not None:
+            parameters["limit"] = limit
         return self.get(endpoint, parameters)
 
+    def iter_playlist_items(self, playlist_id, page_size=500):
+        """yield every item in the playlist, a page at a time"""
+        start_index = 0
+        while True:
+            items = self.lookup_playlist_items(playlist_id, start_index=start_index, limit=page_size).get("Items", [])
+            yield from items
+            if len(items) < page_size:
+                return
+            start_index += page_size
+
     def create_playlist(self, playlist_name):
         body = {"name": playlist_name, "ids": [], "userID": self.user_id, "MediaType": None}
         endpoint = "Playlists"
@@ -73,27 +103,39 @@ class jellyfin:
         parameters = {"ids": item_ids}
         return self.post(endpoint, parameters=parameters)
 
-    def lookup_song(self, song_name, artist_name):
-        parameters = {"searchTerm" : f"{song_name}", "includeItemTypes" : "Audio"}
-        endpoint = "Search/Hints"
-        res = self.get(endpoint, parameters)["SearchHints"]
-        for song in res:
-            # match the song if the name is equivilent and one of the following are true
-            # 1) the results album artist matches the song artist
-            # 2) the song artist in in the results artists list
-            # 3) there is only one result, this is to handle when artist information gets poorly parsed by
-            # jellyfin
-            if song_name in song["Name"] and (song["AlbumArtist"] == artist_name or artist_name in song["Artists"] or len(res) == 1):
-                return song
-
-        print(f"unable to find song matching name: {song_name}, artist: {artist_name}, found the following songs: {res}")
-        return None
-
-    def item_file_path(self, item_id):
-        endpoint = f"Items/{item_id}/PlaybackInfo"
-        parameters = {"userId" : self.user_id}
-        r = self.get(endpoint, parameters)
-        return r["MediaSources"][0]["Path"]
+    def remove_playlist_items(self, playlist_id, entry_ids):
+        """entry_ids are the PlaylistItemId of each item, not the item id"""
+        endpoint = f"Playlists/{playlist_id}/Items"
+        parameters = {"entryIds": ",".join(entry_id for entry_id in entry_ids if entry_id)}
+        return self.delete(endpoint, parameters=parameters)
+
+    def search_songs(self, search_term, limit):
+        """search audio items, including each item's file path so no PlaybackInfo lookup is needed to check it"""
+        parameters = {"searchTerm": search_term,
+                      "includeItemTypes": "Audio",
+                      "recursive": True,
+                      "fields": "Path",
+                      "limit": limit}
+        endpoint = f"Users/{self.user_id}/Items"
+        return self.get(endpoint, parameters).get("Items", [])
+
+    def existing_item_ids(self, item_ids):
+        """the subset of item_ids that still exist on the server"""
+        parameters = {"ids": ",".join(item_ids)}
+        endpoint = f"Users/{self.user_id}/Items"
+        return {item.get("Id") for item in self.get(endpoint, parameters).get("Items", [])}
+
+    def recent_songs(self, limit, start_index=0):
+        """the most recently added audio items, newest first, including their file paths"""
+        parameters = {"includeItemTypes": "Audio",
+                      "startIndex": start_index,
+                      "recursive": True,
+                      "fields": "Path",
+                      "sortBy": "DateCreated",
+                      "sortOrder": "Descending",
+                      "limit": limit}
+        endpoint = f"Users/{self.user_id}/Items"
+        return self.get(endpoint, parameters).get("Items", [])
 
     def scan_library_status(self):
         endpoint = "ScheduledTasks"
@@ -122,50 +164,3 @@ class jellyfin:
 
 
         print("library scan complete")
-
-
-def main():
-    jelly = jellyfin(server_url, username, password)
-
-    # r = jelly.lookup_playlist("test")
-    # print(r)
-
-    # r = jelly.lookup_song("mememe", "100 gecs")
-    # print(r)
-
-#     r = jelly.get("ScheduledTasks")
-#     '''
-# {'StartTimeUtc': '2023-01-10T15:59:55.9646922Z', 'EndTimeUtc': '2023-01-10T16:01:32.6057085Z', 'Status': 'Completed', 'Name': 'Scan Media Library', 'Key': 'RefreshLibrary', 'Id': '7738148ffcd07979c7ceb148e06b3aed'}, 'Triggers': [{'Type': 'IntervalTrigger', 'IntervalTicks': 432000000000}], 'Description': 'Scans your media library for new files and refreshes metadata.', 'Category': 'Library', 'IsHidden': False, 'Key': 'RefreshLibrary'}
-#     '''
-#     print(r)
-
-    # jelly.scan_library()
-
-    # r = jelly.item_file_path("16e0afb01cfb51b4481e538f868a195e")
-    # print(r)
-
-    # r = jelly.lookup_playlist_id("test")
-    # print(r)
-    # r = jelly.lookup_playlist_items(r)
-    # print(r)
-
-    # r = jelly.lookup_song("home", "Cavetown")
-    # print(r)
-    # song_id1 = r["ItemId"]
-
-    # r = jelly.lookup_song("//ashes// (remix) - akira talaba remix", "tip toe")
-    # print(r)
-    # song_id2 = r["ItemId"]
-    # r = jelly.create_playlist("test8")
-    # print(r)
-
-    # jelly.add_playlist_items("e7de5fc9f02e736436aa0a2b882f874b", [song_id1, song_id2])
-    # r = jelly.lookup_playlist_items("e7de5fc9f02e736436aa0a2b882f874b")
-    # print(r)
-
-
-
-
-
-if __name__ == "__main__":
-    main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
+from . import atomic_file
+from . import canonical
+from . import file_walker
 from . import jellyfin_api
+from . import library_index
+from . import spotify_ids
 import datetime
-import time
-import click
-import eyed3
+import json
 import os
-import re
 import shutil
+import time
 
 
 def remove_file(filename):
@@ -15,18 +18,41 @@ def remove_file(filename):
     except FileNotFoundError:
         pass
 
-def sanitize_filename(filename):
-    """Takes only a filename, not a full path"""
-    return re.sub('/', ' ', filename).strip()
+# each song moves through these states in order, and the state is checkpointed after every step
+# so an interrupted or partially failed import can pick up where it left off
+PARSED = "parsed"
+COPIED = "copied"
+INDEXED = "indexed"
+RESOLVED = "resolved"
+ADDED = "added"
+CLEANED = "cleaned"
+SONG_STATES = [PARSED, COPIED, INDEXED, RESOLVED, ADDED, CLEANED]
+
+IMPORT_STATE_FILE = ".jellyfin_import_state.jsonl"
+# songs are resolved, added and cleaned up this many at a time
+BATCH_SIZE = 200
+ADD_BATCH_SIZE = 100
+
+# songs jellyfin can't find are looked up again after LOOKUP_RETRY_DELAY seconds, doubling after every failure up to
+# LOOKUP_RETRY_MAX_DELAY. from MAX_LOOKUP_ATTEMPTS failures on, every further failure is reported
+LOOKUP_RETRY_DELAY = 15 * 60
+LOOKUP_RETRY_MAX_DELAY = 24 * 60 * 60
+MAX_LOOKUP_ATTEMPTS = 10
+
 
 class Song:
-    def __init__(self, name, artist, album, original_file, jellyfin_library_file):
+    def __init__(self, name, artist, album, original_file, jellyfin_library_file, playlist_name=None, spotify_id=None):
         self._name = name
         self._artist  = artist
         self._album = album
         self._original_file = original_file
         self._jellyfin_library_file = jellyfin_library_file
         self._jellyfin_song_id = None
+        self._playlist_name = playlist_name
+        self._spotify_id = spotify_id
+        self._state = PARSED
+        self._lookup_attempts = 0
+        self._next_lookup = None
 
     @property
     def name(self):
@@ -55,67 +81,236 @@ class Song:
     def jellyfin_song_id(self, value):
         self._jellyfin_song_id = value
 
-    def __str__(self):
-        return f"name: {self._name}, artist: {self._artist}, album: {self._album}, library_file: {self._jellyfin_library_file}, original_file: {self._original_file}, jellyfin_song_id: {self._jellyfin_song_id}"
-
-
-
-def canonical_artist(audiofile):
-    track_artist = sanitize_filename(audiofile.tag.artist.split(";")[0])
-    album_artist = sanitize_filename(audiofile.tag.album_artist.split(";")[0])
+    @property
+    def playlist_name(self):
+        return self._playlist_name
 
-    if album_artist not in track_artist:
-        # if the album artist is generic, just use the track artist
-        if "Various Artists" in album_artist:
-            return track_artist
-        elif "Various Artists" in track_artist:
-            return album_artist
-        elif "Traditional" in album_artist:
-            return track_artist
-        elif "Traditional" in track_artist:
-            return album_artist
-        # if we get here and we have not found an appropriate artist, default to the track artist
-        # track artist is generally the correct artist
-        print(f"picking track artist as canonical artist, track_artist = {track_artist}, album_artist = {album_artist}")
-        return track_artist
+    @property
+    def spotify_id(self):
+        return self._spotify_id
 
-    return track_artist
+    @property
+    def state(self):
+        return self._state
 
+    @state.setter
+    def state(self, value):
+        if value not in SONG_STATES:
+            raise ValueError(f"unknown song state {value}")
+        self._state = value
 
-def import_songs_jellyfin(import_dir, jellyfin_library_dir):
-    _, _, song_files = next(os.walk(import_dir), (None, None, []))
+    @property
+    def lookup_attempts(self):
+        return self._lookup_attempts
 
-    songs = []
+    @lookup_attempts.setter
+    def lookup_attempts(self, value):
+        self._lookup_attempts = value
 
-    print(f"importing {len(song_files)} songs...")
+    @property
+    def next_lookup(self):
+        """unix time of the next lookup attempt, None if the song isn't waiting on one"""
+        return self._next_lookup
+
+    @next_lookup.setter
+    def next_lookup(self, value):
+        self._next_lookup = value
+
+    def reached(self, state):
+        return SONG_STATES.index(self._state) >= SONG_STATES.index(state)
+
+    def to_dict(self):
+        return {"name": self._name,
+                "artist": self._artist,
+                "album": self._album,
+                "original_file": self._original_file,
+                "jellyfin_library_file": self._jellyfin_library_file,
+                "jellyfin_song_id": self._jellyfin_song_id,
+                "playlist_name": self._playlist_name,
+                "spotify_id": self._spotify_id,
+                "state": self._state,
+                "lookup_attempts": self._lookup_attempts,
+                "next_lookup": self._next_lookup}
+
+    @classmethod
+    def from_dict(cls, d):
+        song = cls(name=d["name"],
+                   artist=d["artist"],
+                   album=d["album"],
+                   original_file=d["original_file"],
+                   jellyfin_library_file=d["jellyfin_library_file"],
+                   playlist_name=d.get("playlist_name"),
+                   spotify_id=d.get("spotify_id"))
+        song.jellyfin_song_id = d.get("jellyfin_song_id")
+        song.state = d["state"]
+        song.lookup_attempts = d.get("lookup_attempts", 0)
+        song.next_lookup = d.get("next_lookup")
+        return song
 
-    for song_file in song_files:
-        audiofile = eyed3.load(f"{import_dir}/{song_file}")
+    def __str__(self):
+        return f"name: {self._name}, artist: {self._artist}, album: {self._album}, library_file: {self._jellyfin_library_file}, original_file: {self._original_file}, jellyfin_song_id: {self._jellyfin_song_id}, spotify_id: {self._spotify_id}, state: {self._state}, lookup_attempts: {self._lookup_attempts}"
+
+
+class ImportState:
+    """
+    persisted per-song import progress, kept in the import directory next to the files it describes.
+    every checkpoint appends one line to a journal, so the cost of a checkpoint doesn't grow with the number of songs.
+    the journal is compacted down to one line per unfinished song whenever it is loaded
+    """
+
+    def __init__(self, import_dir):
+        self.path = f"{import_dir}/{IMPORT_STATE_FILE}"
+        self.songs = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as state_file:
+                for line in state_file:
+                    try:
+                        song = Song.from_dict(json.loads(line))
+                    except ValueError:
+                        # a crash mid-write can leave a partial last line, the previous checkpoint still stands
+                        continue
+                    if song.state == CLEANED:
+                        self.songs.pop(song.original_file, None)
+                    else:
+                        self.songs[song.original_file] = song
+            print(f"resuming import, {len(self.songs)} songs have saved state")
+            self.compact()
+
+    def get(self, original_file):
+        return self.songs.get(original_file)
+
+    def checkpoint(self, song, state=None):
+        if state is not None:
+            song.state = state
+        if song.state == CLEANED:
+            self.songs.pop(song.original_file, None)
+        else:
+            self.songs[song.original_file] = song
+        if not self.songs:
+            remove_file(self.path)
+            return
+        with open(self.path, "a") as state_file:
+            state_file.write(json.dumps(song.to_dict()) + "\n")
 
-        # multiple artists will look like artist1;artist2;artist3
-        artist_dir = canonical_artist(audiofile)
-        album_dir = sanitize_filename(audiofile.tag.album)
+    def compact(self):
+        if not self.songs:
+            remove_file(self.path)
+            return
+        with atomic_file.atomic_write(self.path) as state_file:
+            for song in self.songs.values():
+                state_file.write(json.dumps(song.to_dict()) + "\n")
+
+
+def batched(iterable, size):
+    """yield lists of up to size items from iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_song(song, state, index):
+    index.makedirs(os.path.dirname(song.jellyfin_library_file))
+    shutil.copy2(song.original_file, song.jellyfin_library_file)
+    if song.spotify_id:
+        # keep the id in the library copy too, so it can be rebuilt from the files alone
+        try:
+            spotify_ids.write_spotify_id(song.jellyfin_library_file, song.spotify_id)
+        except Exception as e:
+            print(f"unable to tag {song.jellyfin_library_file} with spotify id {song.spotify_id}, continuing: {e}")
+    index.add_file(song.jellyfin_library_file)
+    state.checkpoint(song, COPIED)
+
+
+def import_songs_jellyfin(import_dir, jellyfin_library_dir, state, playlist_name, index, canon):
+    """
+    copy every song in import_dir into the library, returns the number of songs copied.
+    every song is kept in state until it has been cleaned up, so state grows with the number of songs imported
+    """
+    copied = 0
+    # start with everything we were partway through last time, even if the original file is already gone
+    for song in list(state.songs.values()):
+        if not song.reached(COPIED):
+            copy_song(song, state, index)
+            copied += 1
+
+    # eyed3 is slow to import and only needed when there is something to import
+    import eyed3
+
+    print(f"importing songs from {import_dir}...")
+
+    # files are parsed and copied as the walker finds them, so large drops start importing right away
+    for original_file, _ in file_walker.walk_files(import_dir):
+        if state.get(original_file) is not None:
+            continue
+
+        audiofile = eyed3.load(original_file)
+
+        # tracks from the same album share their tags, so this is only worked out once per album
+        artist_dir, album_dir = canon.dirs(audiofile.tag.artist, audiofile.tag.album_artist, audiofile.tag.album)
         song_dir = f"{jellyfin_library_dir}/{artist_dir}/{album_dir}"
-        os.makedirs(song_dir, exist_ok=True)
-        shutil.copy2(f"{import_dir}/{song_file}", song_dir)
 
         #TODO which provides better jellyfin search results, straight id3 tags or sanitized canonical versions?
         # id3 tags seems to be good
         song = Song(name=audiofile.tag.title,
                     artist=artist_dir,
                     album=album_dir,
-                    original_file=f"{import_dir}/{song_file}",
-                    jellyfin_library_file=f"{song_dir}/{song_file}")
+                    original_file=original_file,
+                    jellyfin_library_file=f"{song_dir}/{os.path.basename(original_file)}",
+                    playlist_name=playlist_name,
+                    spotify_id=spotify_ids.read_spotify_id(audiofile, original_file))
+        state.checkpoint(song, PARSED)
+        copy_song(song, state, index)
+        copied += 1
 
-        songs.append(song)
+    return copied
 
-    return songs
 
+def sanitize_string(in_string):
+    return in_string.lower().lstrip(" ").rstrip("")
+
+
+# candidate scoring, a candidate must at least match our library file name to be accepted
+SEARCH_LIMIT = 20
+# how many recently added items to list when matching new songs by spotify id
+RECENT_LIMIT = 100
+WIDE_SEARCH_LIMIT = 200
+PATH_SCORE = 8
+
+
+def path_tail(path):
+    # jellyfin may see the library mounted somewhere else, so compare the artist/album/file tail of the path
+    return sanitize_string("/".join(path.split("/")[-3:]))
 
-def get_jellyfin_song_id(jelly, song):
-    def sanitize_string(in_string):
-        return in_string.lower().lstrip(" ").rstrip("")
 
+def score_candidate(song, lookup_song_name, lookup_song_artist, item):
+    score = 0
+    res_path = sanitize_string(item.get("Path") or "")
+    lib_file = sanitize_string(song.jellyfin_library_file.split("/")[-1])
+    if res_path.endswith(path_tail(song.jellyfin_library_file)):
+        score += PATH_SCORE + 4
+    elif lib_file in res_path:
+        score += PATH_SCORE
+
+    name = sanitize_string(item.get("Name") or "")
+    if name == sanitize_string(song.name):
+        score += 2
+    elif sanitize_string(lookup_song_name) in name:
+        score += 1
+
+    # artist information can be poorly parsed by jellyfin, so it only counts towards the score
+    if item.get("AlbumArtist") == lookup_song_artist or lookup_song_artist in (item.get("Artists") or []):
+        score += 2
+    if sanitize_string(item.get("Album") or "") == sanitize_string(song.album):
+        score += 1
+    return score
+
+
+def get_jellyfin_song_id(jelly, song):
     # jellyfin search chokes hard on single quotes
     # there doesn't seem to be a way to escape them
     # additionally, search results are not handled properly:
@@ -172,24 +367,25 @@ def get_jellyfin_song_id(jelly, song):
 
 
     print(f"Looking for song {song.name} {song.artist} using {lookup_song_name} {lookup_song_artist}")
-    r = jelly.lookup_song(lookup_song_name, lookup_song_artist)
-    if r is None:
-        print(f"no results when searching with {lookup_song_name} {lookup_song_artist}. Trying just: {lookup_song_name}")
-        r = jelly.lookup_song(lookup_song_name, "")
-
-
-
-    if r is not None:
-        item_id = r["ItemId"]
-        res_path = jelly.item_file_path(item_id)
-        res_path = sanitize_string(res_path)
-        lib_file = sanitize_string(song.jellyfin_library_file.split("/")[-1])
-        print(f"Finding song id: Checking if {lib_file} is in {res_path}")
-        if lib_file in res_path:
-            print(f"Found song       name:  {r.get('Name')}, artists: {r.get('Artists')}, album: {r.get('Album')}, library_file: {res_path}, id: {item_id}")
-            song.jellyfin_song_id = item_id
-            return
-
+    limit = SEARCH_LIMIT
+    while True:
+        candidates = jelly.search_songs(lookup_song_name, limit)
+        scored = sorted(((score_candidate(song, lookup_song_name, lookup_song_artist, c), -i, c) for i, c in enumerate(candidates)), reverse=True)
+        # only widen the search if the page was full and we couldn't pick a clear winner from it
+        ambiguous = not scored or scored[0][0] < PATH_SCORE or (len(scored) > 1 and scored[0][0] == scored[1][0])
+        if not ambiguous or len(candidates) < limit or limit >= WIDE_SEARCH_LIMIT:
+            break
+        print(f"no clear match in the top {limit} results for {lookup_song_name}, widening the search")
+        limit = WIDE_SEARCH_LIMIT
+
+    if scored and scored[0][0] >= PATH_SCORE:
+        score, _, r = scored[0]
+        item_id = r["Id"]
+        print(f"Found song       name:  {r.get('Name')}, artists: {r.get('Artists')}, album: {r.get('Album')}, library_file: {r.get('Path')}, id: {item_id}, score: {score}")
+        song.jellyfin_song_id = item_id
+        return
+
+    print(f"unable to find song matching name: {lookup_song_name}, artist: {lookup_song_artist}, found the following songs: {[(c.get('Name'), c.get('Path')) for c in candidates]}")
     raise ValueError(f"""unable to find song in jellyfin search results. None of the results matched the following:
     library_file = {sanitize_string(song.jellyfin_library_file)}
     ==================================================================
@@ -198,10 +394,93 @@ def get_jellyfin_song_id(jelly, song):
     """)
 
 
+class RecentItems:
+    """
+    pages through the most recently added items only as far as needed, remembering the path of each item seen.
+    stops after max_items, anything older than that was not added by this import
+    """
+
+    def __init__(self, jelly, max_items):
+        self.jelly = jelly
+        self.max_items = max_items
+        self.fetched = 0
+        self.done = False
+        self.by_path = {}
+
+    def find(self, library_file):
+        tail = path_tail(library_file)
+        while tail not in self.by_path and not self.done:
+            page = self.jelly.recent_songs(RECENT_LIMIT, start_index=self.fetched)
+            self.fetched += len(page)
+            for item in page:
+                self.by_path[path_tail(item.get("Path") or "")] = item["Id"]
+            self.done = len(page) < RECENT_LIMIT or self.fetched >= self.max_items
+        return self.by_path.get(tail)
+
+
+def drop_stale_ids(jelly, id_map, spotify_ids):
+    """
+    forget the mapped items for spotify_ids that no longer exist in jellyfin, for example after the item was deleted
+    or the library rebuilt. jellyfin silently drops unknown ids from a playlist add
+    """
+    mapped = {spotify_id: id_map.get(spotify_id) for spotify_id in set(spotify_ids) if id_map.get(spotify_id)}
+    existing = set()
+    for item_ids in batched(sorted(set(mapped.values())), ADD_BATCH_SIZE):
+        existing |= jelly.existing_item_ids(item_ids)
+    stale = [spotify_id for spotify_id, item_id in mapped.items() if item_id not in existing]
+    for spotify_id in stale:
+        id_map.discard(spotify_id)
+    if stale:
+        print(f"forgot {len(stale)} spotify ids whose jellyfin items no longer exist")
+
+
+def resolve_spotify_ids(jelly, songs, id_map, recent=None):
+    """
+    exact matches for songs that carry a spotify id. ids we have seen before come from id_map once jellyfin confirms
+    the items still exist, new ones are matched by path against the most recently added items, if recent is given
+    """
+    drop_stale_ids(jelly, id_map, [song.spotify_id for song in songs if song.spotify_id])
+    with_ids = 0
+    resolved = 0
+    for song in songs:
+        if not song.spotify_id:
+            continue
+        with_ids += 1
+        item_id = id_map.get(song.spotify_id)
+        if not item_id and recent is not None:
+            item_id = recent.find(song.jellyfin_library_file)
+        if item_id:
+            song.jellyfin_song_id = item_id
+            id_map.set(song.spotify_id, item_id)
+            resolved += 1
+
+    if with_ids:
+        print(f"resolved {resolved} of {with_ids} songs by spotify id")
+
+
+def lookup_due(song, now=None):
+    """whether the song still needs a jellyfin id and isn't backing off from a failed lookup. now=None ignores backoff"""
+    if song.reached(RESOLVED) or song.playlist_name is None:
+        return False
+    return now is None or song.next_lookup is None or song.next_lookup <= now
+
+def queue_lookup_retry(state, song):
+    """
+    schedule another lookup for a song jellyfin couldn't find, usually because it hasn't finished indexing it yet.
+    returns False once the song has failed MAX_LOOKUP_ATTEMPTS times and should be reported, it is still retried
+    """
+    song.lookup_attempts += 1
+    delay = min(LOOKUP_RETRY_DELAY * 2 ** (song.lookup_attempts - 1), LOOKUP_RETRY_MAX_DELAY)
+    song.next_lookup = time.time() + delay
+    state.checkpoint(song)
+    print(f"will look for {song.name} again in {delay // 60} minutes")
+    return song.lookup_attempts < MAX_LOOKUP_ATTEMPTS
+
+
 def get_create_playlist(jelly, name):
     playlist_id = jelly.lookup_playlist_id(name)
     if playlist_id:
-        playlist_items = jelly.lookup_playlist_items(playlist_id)
+        playlist_items = jelly.lookup_playlist_items(playlist_id, limit=0)
         print(f"found playlist name = {name}, id = {playlist_id}, songCount = {playlist_items.get('TotalRecordCount')}")
         return playlist_id
 
@@ -214,97 +493,235 @@ def get_create_playlist(jelly, name):
 
     return playlist_id
 
-def update_playlist(jelly, playlist_id, songs):
-    curr_size = jelly.lookup_playlist_items(playlist_id).get('TotalRecordCount')
+def playlist_item_ids(jelly, playlist_id):
+    return {item.get("Id") for item in jelly.iter_playlist_items(playlist_id)}
+
+def update_playlist(jelly, playlist_id, songs, existing_ids=None):
+    """
+    add songs to the playlist in batches, skipping any already in it.
+    callers adding several batches to the same playlist can pass existing_ids, it is kept up to date with the adds
+    """
+    curr_size = jelly.lookup_playlist_items(playlist_id, limit=0).get('TotalRecordCount')
+    # a resumed import may have already added some of these before it was interrupted
+    if existing_ids is None:
+        existing_ids = playlist_item_ids(jelly, playlist_id)
 
     new_ids = []
+    skipped = 0
     for song in songs:
         # skip over songs without a jellyfin song id
-        if song.jellyfin_song_id:
-            new_ids.append(song.jellyfin_song_id)
-        else:
+        if not song.jellyfin_song_id:
             print(f"skipping song {song.name} as it is missing a jellyfin song id")
-    jelly.add_playlist_items(playlist_id, new_ids)
+        elif song.jellyfin_song_id in existing_ids:
+            skipped += 1
+        else:
+            new_ids.append(song.jellyfin_song_id)
+            existing_ids.add(song.jellyfin_song_id)
+    if skipped:
+        print(f"skipping {skipped} songs already in the playlist")
+    # the ids go in the query string, keep each request a reasonable size
+    for ids in batched(new_ids, ADD_BATCH_SIZE):
+        jelly.add_playlist_items(playlist_id, ids)
     expected_size = curr_size + len(new_ids)
 
-    actual_size = jelly.lookup_playlist_items(playlist_id).get('TotalRecordCount')
+    actual_size = jelly.lookup_playlist_items(playlist_id, limit=0).get('TotalRecordCount')
 
     if(expected_size != actual_size):
         raise ValueError(f"expected {expected_size} songs in playlist after adding {len(new_ids)} songs. Found {actual_size} songs in playlist.")
     print(f"Added {len(new_ids)} songs to playlist {playlist_id}")
 
 
-def run(jellyfin_username, jellyfin_password, server, import_dir, jellyfin_library_dir, empty_import_dir):
-    if not os.path.isdir(import_dir):
-        raise ValueError(f"import directory does not exist: {import_dir}")
+def monthly_playlist_name():
+    date = datetime.datetime.now()
+    return date.strftime("%Y") + " " + date.strftime("%m") + " " + date.strftime("%B")
+
+
+class ImportJob:
+    """one import directory, the playlist its new songs go into, and the jellyfin user that owns that playlist"""
+
+    def __init__(self, jelly, import_dir, playlist_name):
+        self.jelly = jelly
+        self.import_dir = import_dir
+        self.playlist_name = playlist_name
+        self.state = None
+
+
+def finish_songs(job, songs, id_map, recent, failed_lookups, empty_import_dir, retry_later):
+    """
+    resolve, add to their playlists and clean up songs that have been indexed, BATCH_SIZE at a time.
+    songs jellyfin can't find are queued for another lookup. failed_lookups collects every failure unless retry_later
+    is set, then only the songs that have failed MAX_LOOKUP_ATTEMPTS times.
+    without retry_later the backoff is ignored, callers with no scheduler draining the queue look for every song
+    """
+    # ids already in each playlist, fetched once per playlist and kept up to date as batches are added
+    playlist_ids = {}
+    # songs already added still need cleaning up if we were interrupted before removing their file.
+    # copied up front, cleaning a song up removes it from the state the caller may be iterating over
+    for batch in batched(list(songs), BATCH_SIZE):
+        now = time.time()
+        to_resolve = [song for song in batch if lookup_due(song, now if retry_later else None)]
+        resolve_spotify_ids(job.jelly, to_resolve, id_map, recent)
+        queued = 0
+        for song in to_resolve:
+            # fall back to searching for songs without a spotify id, or that didn't show up in the recent items
+            if not song.jellyfin_song_id:
+                try:
+                    get_jellyfin_song_id(job.jelly, song)
+                except ValueError as e:
+                    print("Failed to find song in jellyfin, continuing")
+                    if queue_lookup_retry(job.state, song) and retry_later:
+                        queued += 1
+                    else:
+                        # hold the error until later so we can try to do our best creating and filling the playlist
+                        failed_lookups.append(e)
+                    continue
+                if song.spotify_id:
+                    id_map.set(song.spotify_id, song.jellyfin_song_id)
+            job.state.checkpoint(song, RESOLVED)
+        id_map.save()
+        if queued:
+            print(f"{queued} songs are queued for another lookup")
+
+        # songs may be headed to different playlists if they were left over from an earlier run, a song always goes
+        # to the playlist it was imported for even if that month is over by the time it resolves
+        playlists = {}
+        for song in batch:
+            if song.reached(RESOLVED) and not song.reached(ADDED):
+                playlists.setdefault(song.playlist_name, []).append(song)
+        for name, playlist_songs in playlists.items():
+            if name not in playlist_ids:
+                playlist_id = get_create_playlist(job.jelly, name)
+                playlist_ids[name] = (playlist_id, playlist_item_ids(job.jelly, playlist_id))
+            playlist_id, existing_ids = playlist_ids[name]
+            update_playlist(job.jelly, playlist_id, playlist_songs, existing_ids)
+            for song in playlist_songs:
+                job.state.checkpoint(song, ADDED)
+
+        if empty_import_dir:
+            for song in batch:
+                # songs without a playlist are done once jellyfin has indexed them
+                done = song.reached(ADDED) or (song.playlist_name is None and song.reached(INDEXED))
+                if done:
+                    remove_file(song.original_file)
+                    job.state.checkpoint(song, CLEANED)
+
+
+def import_many(jobs, jellyfin_library_dir, empty_import_dir, index=None, id_map=None, canon=None, retry_later=False):
+    """
+    run every song in each job's import_dir through the import states, skipping the steps already checkpointed by a
+    previous run. the jobs share a single library scan and a single pass over the recently added items.
+    songs are resolved, added and cleaned up in batches of BATCH_SIZE, which bounds the size of each jellyfin request.
+    every song's state is held in memory until it is cleaned up, so memory still grows with the size of the import.
+    long running callers can pass in a loaded index, id_map and canon to reuse them across imports.
+    returns the list of failed lookups. callers that drain the queue with retry_lookups can set retry_later, then
+    only songs that have failed MAX_LOOKUP_ATTEMPTS times are returned
+    """
     if not os.path.isdir(jellyfin_library_dir):
         raise ValueError(f"jellyfin library directory does not exist: {jellyfin_library_dir}")
+    for job in jobs:
+        if not os.path.isdir(job.import_dir):
+            raise ValueError(f"import directory does not exist: {job.import_dir}")
 
     failed_lookups = []
 
-    jelly = jellyfin_api.jellyfin(server, jellyfin_username, jellyfin_password)
-    songs = import_songs_jellyfin(import_dir, jellyfin_library_dir)
-    jelly.scan_library()
-    for song in songs:
-        try:
-            get_jellyfin_song_id(jelly, song)
-        except ValueError as e:
-            print("Failed to find song in jellyfin, continuing")
-            # hold the error until later so we can try to do our best creating and filling the playlist
-            failed_lookups.append(e)
+    if index is None:
+        index = library_index.LibraryIndex(jellyfin_library_dir)
+    if id_map is None:
+        id_map = spotify_ids.SpotifyIdMap(jellyfin_library_dir)
+    if canon is None:
+        canon = canonical.Canonicalizer(jellyfin_library_dir)
+    index.refresh()
+    copied = 0
+    for job in jobs:
+        job.state = ImportState(job.import_dir)
+        copied += import_songs_jellyfin(job.import_dir, jellyfin_library_dir, job.state, job.playlist_name, index, canon)
+    index.save()
+    print(f"copied {copied} songs into the library")
+
+    # only rescan if we copied something jellyfin hasn't seen yet. the scan covers the whole server so one is enough
+    unindexed = [(job, song) for job in jobs for song in job.state.songs.values() if not song.reached(INDEXED)]
+    if unindexed:
+        jobs[0].jelly.scan_library()
+        for job, song in unindexed:
+            job.state.checkpoint(song, INDEXED)
+    else:
+        print("no newly copied songs, skipping library scan")
+
+    num_to_resolve = sum(1 for job in jobs for song in job.state.songs.values() if not song.reached(RESOLVED))
+    recent = RecentItems(jobs[0].jelly, max_items=2 * num_to_resolve + RECENT_LIMIT)
+
+    for job in jobs:
+        finish_songs(job, job.state.songs.values(), id_map, recent, failed_lookups, empty_import_dir, retry_later)
+
+    return failed_lookups
+
+
+def retry_lookups(jobs, jellyfin_library_dir, empty_import_dir, id_map=None):
+    """
+    drain the lookup retry queue: look up the songs whose backoff has expired and add the ones found to the
+    playlist they were imported for. only the queued songs are searched for, nothing is walked, copied or scanned.
+    returns the lookups that have now failed MAX_LOOKUP_ATTEMPTS times or more, they are still retried
+    """
+    failed_lookups = []
+    if id_map is None:
+        id_map = spotify_ids.SpotifyIdMap(jellyfin_library_dir)
+    for job in jobs:
+        if not os.path.isfile(f"{job.import_dir}/{IMPORT_STATE_FILE}"):
+            continue
+        job.state = ImportState(job.import_dir)
+        now = time.time()
+        queued = [song for song in job.state.songs.values() if song.lookup_attempts and lookup_due(song, now)]
+        if not queued:
+            continue
+        print(f"retrying lookups for {len(queued)} songs in {job.import_dir}")
+        finish_songs(job, queued, id_map, None, failed_lookups, empty_import_dir, retry_later=True)
+    return failed_lookups
+
+
+def import_and_add(jellyfin_username, jellyfin_password, server, import_dir, jellyfin_library_dir, empty_import_dir, playlist_name, jelly=None, index=None, id_map=None):
+    """import_many for a single import_dir, logging in to jellyfin unless an authenticated jelly is passed in"""
+    if jelly is None:
+        jelly = jellyfin_api.jellyfin(server, jellyfin_username, jellyfin_password)
+    return import_many([ImportJob(jelly, import_dir, playlist_name)],
+                       jellyfin_library_dir=jellyfin_library_dir,
+                       empty_import_dir=empty_import_dir,
+                       index=index,
+                       id_map=id_map)
 
-    date = datetime.datetime.now()
-    playlist_name = date.strftime("%Y") + " " + date.strftime("%m") + " " + date.strftime("%B")
-    playlist_id = get_create_playlist(jelly, playlist_name)
-    update_playlist(jelly, playlist_id, songs)
+
+def run(jellyfin_username, jellyfin_password, server, import_dir, jellyfin_library_dir, empty_import_dir):
+    failed_lookups = import_and_add(jellyfin_username=jellyfin_username,
+                                    jellyfin_password=jellyfin_password,
+                                    server=server,
+                                    import_dir=import_dir,
+                                    jellyfin_library_dir=jellyfin_library_dir,
+                                    empty_import_dir=empty_import_dir,
+                                    playlist_name=monthly_playlist_name())
 
     if failed_lookups:
-        # if we failed some lookups, 
+        # the songs are left in the import dir and looked up again on the next run
         print("Failed the following lookups:")
         for failed_lookup in failed_lookups:
             print(failed_lookup)
         raise ValueError("Failed to add all songs to playlist")
 
-    if empty_import_dir:
-        for song in songs:
-            os.remove(song.original_file)
-
-
-def run_manual(jellyfin_username, jellyfin_password, server, import_dir, jellyfin_library_dir, empty_import_dir, playlist_name):
-    if not os.path.isdir(import_dir):
-        raise ValueError(f"import directory does not exist: {import_dir}")
-    if not os.path.isdir(jellyfin_library_dir):
-        raise ValueError(f"jellyfin library directory does not exist: {jellyfin_library_dir}")
-
-    jelly = jellyfin_api.jellyfin(server, jellyfin_username, jellyfin_password)
-    songs = import_songs_jellyfin(import_dir, jellyfin_library_dir)
-    jelly.scan_library()
 
+def run_manual(jellyfin_username, jellyfin_password, server, import_dir, jellyfin_library_dir, empty_import_dir, playlist_name, jelly=None, index=None, id_map=None):
     if playlist_name is not None:
         print(f"creating new playlist {playlist_name}")
-        for song in songs:
-            get_jellyfin_song_id(jelly, song)
-        playlist_id = get_create_playlist(jelly, playlist_name)
-        update_playlist(jelly, playlist_id, songs)
-
-    if empty_import_dir:
-        for song in songs:
-            os.remove(song.original_file)
-
-@click.command()
-@click.option("--jellyfin_username", type=str, required=True, help="username of the user to login as")
-@click.option("--jellyfin_password", type=str, required=True, help="password of the user to login as")
-@click.option("--server", type=str, required=True, help="server url")
-@click.option("--import_dir", type=str, required=True, help="directory to import music from")
-@click.option("--jellyfin_library_dir", type=str, required=True, help="directory to import music to")
-@click.option("--empty_import_dir", is_flag=True, default=False, help="remove all songs from the import_dir when complete")
-def main(jellyfin_username, jellyfin_password, server, import_dir, jellyfin_library_dir, empty_import_dir):
-    run(jellyfin_username=jellyfin_username,
-        jellyfin_password=jellyfin_password,
-        server=server,
-        import_dir=import_dir,
-        jellyfin_library_dir=jellyfin_library_dir,
-        empty_import_dir=empty_import_dir)
+    failed_lookups = import_and_add(jellyfin_username=jellyfin_username,
+                                    jellyfin_password=jellyfin_password,
+                                    server=server,
+                                    import_dir=import_dir,
+                                    jellyfin_library_dir=jellyfin_library_dir,
+                                    empty_import_dir=empty_import_dir,
+                                    playlist_name=playlist_name,
+                                    jelly=jelly,
+                                    index=index,
+                                    id_map=id_map)
+    if failed_lookups:
+        raise failed_lookups[0]
 
 if __name__ == "__main__":
-    main()
+    from .cli import jellyfin_import
+    jellyfin_import()
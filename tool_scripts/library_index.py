@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+from . import atomic_file
+import json
+import os
+import stat
+
+
+INDEX_FILE = ".jellyfin_spotify_index.json"
+# version 2 indexes stored files without the hash column, they are rebuilt
+INDEX_VERSION = 3
+
+# quick hash reads this much from the start and end of the file instead of the whole thing
+HASH_CHUNK = 64 * 1024
+
+
+def quick_hash(path, size):
+    """hash of the size plus the head and tail of the file, enough to spot duplicates without reading whole songs"""
+    import hashlib
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(HASH_CHUNK))
+        if size > 2 * HASH_CHUNK:
+            f.seek(-HASH_CHUNK, os.SEEK_END)
+            h.update(f.read(HASH_CHUNK))
+    return h.hexdigest()
+
+
+class LibraryIndex:
+    """
+    persistent index of the jellyfin library laid out as artist/album/file.
+
+    every directory is stored with its mtime, its files as [size, mtime_ns, hash] and its subdirectories.
+    adding, removing or renaming entries bumps a directory's mtime, so a refresh only has to list the directories
+    whose mtime changed since the last refresh. files edited in place without being replaced are not noticed.
+    hashes are computed lazily, the first time they are asked for.
+    """
+
+    def __init__(self, library_dir, index_file=None):
+        self.library_dir = os.path.abspath(library_dir)
+        self.index_file = index_file or f"{self.library_dir}/{INDEX_FILE}"
+        self.dirs = {}
+        if os.path.isfile(self.index_file):
+            try:
+                with open(self.index_file) as f:
+                    index = json.load(f)
+                if index.get("version") == INDEX_VERSION:
+                    self.dirs = index["dirs"]
+            except (OSError, ValueError) as e:
+                print(f"unable to load library index {self.index_file}, rebuilding it: {e}")
+
+    def _rel(self, path):
+        rel = os.path.relpath(os.path.abspath(path), self.library_dir)
+        return "" if rel == "." else rel
+
+    def _abs(self, rel):
+        return f"{self.library_dir}/{rel}" if rel else self.library_dir
+
+    def refresh(self):
+        """bring the index up to date with the disk, returns the number of directories that had to be listed"""
+        seen = set()
+        listed = 0
+        root_mtime = os.stat(self.library_dir).st_mtime_ns
+        stack = [("", root_mtime)]
+        while stack:
+            rel, mtime = stack.pop()
+            seen.add(rel)
+            entry = self.dirs.get(rel)
+            if entry is not None and entry["mtime"] == mtime:
+                # nothing was added or removed here, but a subdirectory may still have changed
+                for name in entry["subdirs"]:
+                    sub_rel = f"{rel}/{name}" if rel else name
+                    try:
+                        stack.append((sub_rel, os.stat(self._abs(sub_rel)).st_mtime_ns))
+                    except FileNotFoundError:
+                        pass
+                continue
+
+            listed += 1
+            old_files = entry["files"] if entry is not None else {}
+            files = {}
+            subdirs = []
+            with os.scandir(self._abs(rel)) as it:
+                for dir_entry in it:
+                    if dir_entry.name.startswith("."):
+                        continue
+                    st = dir_entry.stat(follow_symlinks=False)
+                    if stat.S_ISDIR(st.st_mode):
+                        subdirs.append(dir_entry.name)
+                        sub_rel = f"{rel}/{dir_entry.name}" if rel else dir_entry.name
+                        stack.append((sub_rel, st.st_mtime_ns))
+                    elif stat.S_ISREG(st.st_mode):
+                        old = old_files.get(dir_entry.name)
+                        # keep the old hash if the file looks unchanged
+                        file_hash = old[2] if old and old[0] == st.st_size and old[1] == st.st_mtime_ns else None
+                        files[dir_entry.name] = [st.st_size, st.st_mtime_ns, file_hash]
+            self.dirs[rel] = {"mtime": mtime, "files": files, "subdirs": subdirs}
+
+        for rel in list(self.dirs):
+            if rel not in seen:
+                del self.dirs[rel]
+
+        print(f"library index refreshed, listed {listed} of {len(self.dirs)} directories")
+        return listed
+
+    def save(self):
+        with atomic_file.atomic_write(self.index_file) as f:
+            json.dump({"version": INDEX_VERSION, "dirs": self.dirs}, f)
+
+    def dir_exists(self, path):
+        return self._rel(path) in self.dirs
+
+    def makedirs(self, path):
+        """os.makedirs, skipped entirely when the index already knows the directory exists"""
+        rel = self._rel(path)
+        if rel in self.dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        # register each new level, with no mtime so the next refresh lists it
+        parent = ""
+        for name in rel.split("/"):
+            child = f"{parent}/{name}" if parent else name
+            if child not in self.dirs:
+                self.dirs[child] = {"mtime": None, "files": {}, "subdirs": []}
+                parent_entry = self.dirs.get(parent)
+                if parent_entry is not None and name not in parent_entry["subdirs"]:
+                    parent_entry["subdirs"].append(name)
+            parent = child
+
+    def add_file(self, path, file_hash=None):
+        """record a file we just wrote into the library"""
+        st = os.stat(path)
+        rel_dir = self._rel(os.path.dirname(path))
+        if rel_dir not in self.dirs:
+            self.makedirs(os.path.dirname(path))
+        self.dirs[rel_dir]["files"][os.path.basename(path)] = [st.st_size, st.st_mtime_ns, file_hash]
+
+    def lookup(self, path):
+        """returns [size, mtime_ns, hash] for a file in the library, or None"""
+        entry = self.dirs.get(self._rel(os.path.dirname(path)))
+        if entry is None:
+            return None
+        return entry["files"].get(os.path.basename(path))
+
+    def contains(self, artist, album, filename):
+        return self.lookup(f"{self.library_dir}/{artist}/{album}/{filename}") is not None
+
+    def album_files(self, artist, album):
+        entry = self.dirs.get(f"{artist}/{album}")
+        if entry is None:
+            return {}
+        return entry["files"]
+
+    def file_hash(self, path):
+        info = self.lookup(path)
+        if info is None:
+            return None
+        if info[2] is None:
+            info[2] = quick_hash(path, info[0])
+        return info[2]
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+from . import atomic_file
+import json
+import os
+
+
+SNAPSHOT_FILE = ".jellyfin_spotify_mirror.json"
+TRACK_PAGE_LIMIT = 100
+# when more than this share of the playlist has to be downloaded, download the whole playlist in one go rather than
+# starting the downloader once per track
+FULL_DOWNLOAD_FRACTION = 0.5
+
+
+class SnapshotCache:
+    """spotify playlist snapshot ids as of the last complete sync, kept in the library root"""
+
+    def __init__(self, library_dir):
+        self.path = f"{library_dir}/{SNAPSHOT_FILE}"
+        self.snapshots = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    self.snapshots = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"unable to load playlist snapshots {self.path}, starting fresh: {e}")
+
+    def get(self, playlist_uri):
+        return self.snapshots.get(playlist_uri)
+
+    def set(self, playlist_uri, snapshot_id):
+        self.snapshots[playlist_uri] = snapshot_id
+        with atomic_file.atomic_write(self.path) as f:
+            json.dump(self.snapshots, f)
+
+
+def spotify_playlist_tracks(spotify_api, playlist_uri):
+    """every track in the playlist, in order, as {"id", "name", "artists"}. only those fields are requested"""
+    tracks = []
+    offset = 0
+    while True:
+        page = spotify_api.playlist_items(playlist_uri,
+                                          fields="items(track(id,type,name,artists(name))),next",
+                                          limit=TRACK_PAGE_LIMIT,
+                                          offset=offset,
+                                          additional_types=("track",))
+        for item in page.get("items", []):
+            track = item.get("track") or {}
+            # local files and removed tracks have no id, and can't be downloaded anyway
+            if track.get("type") == "track" and track.get("id"):
+                tracks.append({"id": track["id"],
+                               "name": track.get("name") or "",
+                               "artists": [artist.get("name") or "" for artist in track.get("artists") or []]})
+        if not page.get("next"):
+            return tracks
+        offset += TRACK_PAGE_LIMIT
+
+
+def match_playlist_items(jelly, id_map, playlist_id, tracks):
+    """
+    a whole playlist download doesn't tell us which file is which track. match the jellyfin playlist items back to the
+    spotify tracks by name and artist, so the next sync knows they are already there. ambiguous names are skipped
+    """
+    by_name = {}
+    for track in tracks:
+        for artist in track["artists"]:
+            key = (track["name"].casefold(), artist.casefold())
+            # the same track can be in a playlist more than once, only distinct tracks with the same name are ambiguous
+            by_name[key] = track["id"] if by_name.get(key, track["id"]) == track["id"] else None
+
+    mapped_items = set(id_map.ids.values())
+    matched = 0
+    for item in jelly.iter_playlist_items(playlist_id):
+        if item.get("Id") in mapped_items:
+            continue
+        name = (item.get("Name") or "").casefold()
+        for artist in (item.get("Artists") or []) + [item.get("AlbumArtist") or ""]:
+            track_id = by_name.get((name, artist.casefold()))
+            if track_id and not id_map.get(track_id):
+                id_map.set(track_id, item["Id"])
+                matched += 1
+                break
+    id_map.save()
+    print(f"matched {matched} playlist items to their spotify tracks by name")
+
+
+def sync(spotify_api, jelly, id_map, snapshots, playlist_uri, download_and_import, remove_dropped=False):
+    """
+    make the jellyfin playlist named after the spotify playlist match it.
+    tracks already in the library are added directly, only tracks we have never imported are handed to
+    download_and_import(uris, playlist_name), which is expected to import them into that playlist. when most of the
+    playlist is missing it is handed the playlist uri instead, to download everything at once.
+    tracks dropped from the spotify playlist are removed from the jellyfin playlist if remove_dropped is set.
+    jellyfin playlist items we can't map back to a spotify id are never touched.
+    """
+    # imported here so this module doesn't pull in eyed3 and friends until a sync actually runs
+    from . import jellyfin_import
+
+    playlist = spotify_api.playlist(playlist_uri, fields="name,snapshot_id")
+    name = playlist["name"]
+    snapshot_id = playlist["snapshot_id"]
+    if snapshots.get(playlist_uri) == snapshot_id:
+        print(f"spotify playlist {name} is unchanged since the last sync")
+        return
+
+    tracks = spotify_playlist_tracks(spotify_api, playlist_uri)
+    track_ids = [track["id"] for track in tracks]
+    wanted = set(track_ids)
+
+    playlist_id = jellyfin_import.get_create_playlist(jelly, name)
+    spotify_id_by_item = {item_id: spotify_id for spotify_id, item_id in id_map.ids.items()}
+    present = set()
+    dropped_entries = []
+    for item in jelly.iter_playlist_items(playlist_id):
+        spotify_id = spotify_id_by_item.get(item.get("Id"))
+        if spotify_id is None:
+            continue
+        if spotify_id in wanted:
+            present.add(spotify_id)
+        elif item.get("PlaylistItemId"):
+            dropped_entries.append(item.get("PlaylistItemId"))
+
+    missing = [track_id for track_id in track_ids if track_id not in present]
+    # dedupe while keeping the playlist order, the same track can be in a playlist more than once
+    missing = list(dict.fromkeys(missing))
+    # anything mapped to an item jellyfin no longer has is downloaded again
+    jellyfin_import.drop_stale_ids(jelly, id_map, missing)
+    id_map.save()
+    in_library = [id_map.get(track_id) for track_id in missing if id_map.get(track_id)]
+    to_download = [f"spotify:track:{track_id}" for track_id in missing if not id_map.get(track_id)]
+    print(f"syncing playlist {name}: {len(track_ids)} tracks on spotify, {len(present)} already in jellyfin, "
+          f"{len(in_library)} to add from the library, {len(to_download)} to download, {len(dropped_entries)} dropped")
+
+    for item_ids in jellyfin_import.batched(in_library, jellyfin_import.ADD_BATCH_SIZE):
+        jelly.add_playlist_items(playlist_id, item_ids)
+    if len(to_download) > 1 and len(to_download) > FULL_DOWNLOAD_FRACTION * len(wanted):
+        print(f"downloading all of playlist {name} as {len(to_download)} of its {len(wanted)} tracks are missing")
+        download_and_import([playlist_uri], name)
+        match_playlist_items(jelly, id_map, playlist_id, tracks)
+    elif to_download:
+        download_and_import(to_download, name)
+    if dropped_entries and remove_dropped:
+        for entry_ids in jellyfin_import.batched(dropped_entries, jellyfin_import.ADD_BATCH_SIZE):
+            jelly.remove_playlist_items(playlist_id, entry_ids)
+        print(f"removed {len(dropped_entries)} dropped tracks from playlist {name}")
+
+    # only remember the snapshot once everything went through, so a failed sync is retried in full next time
+    snapshots.set(playlist_uri, snapshot_id)
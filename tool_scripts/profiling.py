@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# opt-in profiling for the scheduled and manual runs.
+#
+# every run gets its own directory under PROFILE_DIR holding, for each stage:
+#   - <stage>.prof : cProfile output for the thread that ran the stage, open with python -m pstats or snakeviz
+#   - <stage>.collapsed : stacks sampled from every thread, one "frame;frame;frame count" line per stack, the input
+#     flamegraph.pl and speedscope expect
+# PROFILE_RUNS limits profiling to a comma separated list of run names, every run is profiled when it is unset.
+# the newest PROFILE_KEEP directories are kept for each run name, so frequent runs don't push out the rare ones.
+# stages must not nest, only one cProfile can run at a time
+import contextlib
+import datetime
+import os
+import shutil
+import sys
+import threading
+
+
+DEFAULT_KEEP = 20
+# milliseconds between stack samples
+DEFAULT_INTERVAL = 10
+
+
+def frame_label(frame):
+    code = frame.f_code
+    # ; separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+class StackSampler:
+    """counts the stacks of every other thread, sampled every interval seconds until stopped"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+
+    def _sample(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    profile the stages of a run. does nothing unless out_dir is set, so callers can wrap their stages
+    unconditionally
+    """
+
+    def __init__(self, out_dir=None, keep=DEFAULT_KEEP, interval=DEFAULT_INTERVAL, runs=None):
+        self.out_dir = out_dir
+        self.keep = keep
+        self.interval = interval
+        # names of the runs to profile, None for all of them
+        self.runs = runs
+        self._run_dir = threading.local()
+
+    @classmethod
+    def from_env(cls):
+        """configured by PROFILE_DIR, PROFILE_KEEP, PROFILE_INTERVAL (milliseconds) and PROFILE_RUNS"""
+        out_dir = os.environ.get("PROFILE_DIR", "")
+        if not out_dir:
+            return cls()
+        keep = int(os.environ.get("PROFILE_KEEP", "") or DEFAULT_KEEP)
+        interval = int(os.environ.get("PROFILE_INTERVAL", "") or DEFAULT_INTERVAL)
+        runs = {name.strip() for name in os.environ.get("PROFILE_RUNS", "").split(",") if name.strip()} or None
+        print(f"profiling {', '.join(sorted(runs)) if runs else 'all'} runs into {out_dir}, keeping the last {keep} of each")
+        return cls(out_dir, keep, interval, runs)
+
+    @property
+    def enabled(self):
+        return bool(self.out_dir)
+
+    @contextlib.contextmanager
+    def run(self, name):
+        """
+        group the stages profiled inside this block into one run directory.
+        yields whether the run is being profiled, stages inside a run that isn't are not profiled either
+        """
+        if not self.enabled:
+            yield False
+            return
+        if self.runs is not None and name not in self.runs:
+            self._run_dir.skip = True
+            try:
+                yield False
+            finally:
+                self._run_dir.skip = False
+            return
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        run_dir = f"{self.out_dir}/{timestamp}-{name}"
+        try:
+            os.makedirs(run_dir, exist_ok=True)
+        except OSError as e:
+            # losing a profile should never fail the run it was measuring
+            print(f"unable to create profile directory {run_dir}, not profiling this run: {e}")
+            self._run_dir.skip = True
+            try:
+                yield False
+            finally:
+                self._run_dir.skip = False
+            return
+        self._run_dir.path = run_dir
+        try:
+            yield True
+        finally:
+            self._run_dir.path = None
+            print(f"profiles for {name} written to {run_dir}")
+            self.prune(name)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """profile the block. stages outside of a run get a run of their own"""
+        if not self.enabled or getattr(self._run_dir, "skip", False):
+            yield
+            return
+        run_dir = getattr(self._run_dir, "path", None)
+        if run_dir is None:
+            with self.run(name) as profiling:
+                if profiling:
+                    with self.stage(name):
+                        yield
+                else:
+                    yield
+            return
+
+        # imported here so runs without profiling don't pay for it
+        import cProfile
+
+        # stage names can include spotify usernames and uris
+        file_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+        # a stage that runs more than once in a run, like one download per track, gets numbered
+        count = 2
+        base_name = file_name
+        while os.path.exists(f"{run_dir}/{file_name}.prof"):
+            file_name = f"{base_name}-{count}"
+            count += 1
+        profile = cProfile.Profile()
+        sampler = StackSampler(self.interval / 1000)
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            try:
+                profile.dump_stats(f"{run_dir}/{file_name}.prof")
+                sampler.write(f"{run_dir}/{file_name}.collapsed")
+            except OSError as e:
+                print(f"unable to write profile for stage {name}: {e}")
+
+    def prune(self, name):
+        """remove all but the newest keep run directories for runs called name"""
+        try:
+            # run directories are <date>-<time>-<microseconds>-<name>
+            runs = sorted(entry for entry in os.listdir(self.out_dir)
+                          if os.path.isdir(f"{self.out_dir}/{entry}") and entry.split("-", 3)[-1] == name)
+        except OSError as e:
+            print(f"unable to list profiles in {self.out_dir}: {e}")
+            return
+        for old_run in runs[:-self.keep] if self.keep > 0 else []:
+            shutil.rmtree(f"{self.out_dir}/{old_run}", ignore_errors=True)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import threading
+import time
+
+
+# statuses that mean the server wants us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+# per-service starting points, the limiter adapts from here based on what the server tells us
+LIMITER_DEFAULTS = {
+    "jellyfin": {"rate": 20.0, "burst": 20, "max_concurrency": 8, "latency_threshold": 2.0},
+    "spotify": {"rate": 10.0, "burst": 10, "max_concurrency": 4, "latency_threshold": 1.0},
+}
+
+
+def parse_retry_after(value):
+    """Retry-After is either a number of seconds or an http date"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # email.utils is slow to import and servers rarely send dates
+    import email.utils
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateLimiter:
+    """
+    token bucket limiting the request rate, combined with an AIMD limit on the number of requests in flight.
+    successful fast responses slowly raise the limits, 429/503 responses and slow responses cut them in half.
+    """
+
+    def __init__(self, rate, burst, max_concurrency, latency_threshold, min_rate=0.5, max_retries=5):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.latency_threshold = latency_threshold
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_refill = time.monotonic()
+        self.cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1 and self.in_flight < int(self.concurrency):
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        return
+                    if self.tokens < 1:
+                        wait = (1 - self.tokens) / self.rate
+                # with no timeout we are waiting on a request in flight to be released
+                self.cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, latency, throttled=False, retry_after=None):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                # multiplicative decrease
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.rate = max(self.min_rate, self.rate / 2)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                print(f"throttled, backing off to {self.rate:.2f} req/s with {int(self.concurrency)} in flight")
+            elif latency > self.latency_threshold:
+                # the server is struggling, ease off before it starts failing
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.rate = max(self.min_rate, self.rate * 0.75)
+            else:
+                # additive increase
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+            self.cond.notify_all()
+
+    def call(self, send):
+        """run send() under the limiter, retrying throttled responses. send must return a requests.Response"""
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.monotonic()
+            try:
+                r = send()
+            except OSError:
+                # every requests exception is an OSError. treat a server that can't be reached or timed out like a
+                # throttle, but leave the error handling to the caller
+                self.release(time.monotonic() - start, throttled=True)
+                raise
+            except BaseException:
+                self.release(time.monotonic() - start)
+                raise
+
+            throttled = r.status_code in THROTTLE_STATUSES
+            retry_after = None
+            if throttled:
+                retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = min(60, 2 ** attempt)
+            self.release(time.monotonic() - start, throttled=throttled, retry_after=retry_after)
+
+            if not throttled or attempt >= self.max_retries:
+                return r
+            attempt += 1
+            print(f"got {r.status_code} from {r.url}, retrying in {retry_after:.1f}s (attempt {attempt}/{self.max_retries})")
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """limiters are shared per service so every caller in the process backs off together"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(**LIMITER_DEFAULTS[name])
+        return _limiters[name]
+
+
+# a 5xx from a proxy can come after the server already applied the request, only these are safe to send again
+IDEMPOTENT_METHODS = ("GET", "DELETE")
+
+
+def session(name, retries=10, backoff_factor=1.5, retry_methods=IDEMPOTENT_METHODS):
+    """
+    requests session whose calls all go through the named limiter.
+    connection errors are retried by urllib3, as are 500/502/504 responses to retry_methods.
+    429/503 are left to the limiter so it can see them and honor Retry-After
+    """
+    # imported here so tools that never make a request don't pay for loading requests
+    import requests
+    import urllib3
+
+    class RateLimitedSession(requests.Session):
+        def __init__(self, limiter):
+            super().__init__()
+            self.limiter = limiter
+
+        def request(self, *args, **kwargs):
+            return self.limiter.call(lambda: super(RateLimitedSession, self).request(*args, **kwargs))
+
+    s = RateLimitedSession(get_limiter(name))
+    retry = urllib3.Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(retry_methods),
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 504),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+from . import rate_limiter
+import os
+from json.decoder import JSONDecodeError
+
+
+# the methods spotipy retries on 5xx when it builds its own session, kept so handing it ours changes nothing
+SPOTIPY_RETRY_METHODS = ("GET", "POST", "PUT", "DELETE")
+
+
+def start_api(username):
+    """
+    the following must be set:
+    SPOTIPY_CLIENT_ID
+    SPOTIPY_CLIENT_SECRET
+    SPOTIPY_REDIRECT_URI
+    """
+    # spotipy pulls in requests and friends, only pay for that when we actually talk to spotify
+    import spotipy
+    import spotipy.util as util
+
+    # check for env vars
+    os.environ["SPOTIPY_CLIENT_ID"]
+    os.environ["SPOTIPY_CLIENT_SECRET"]
+    os.environ["SPOTIPY_REDIRECT_URI"]
+    scope = 'user-read-private user-read-playback-state user-modify-playback-state user-library-read playlist-modify-private playlist-modify-public'
+
+    try:
+        token = util.prompt_for_user_token(username, scope)
+    except (AttributeError, JSONDecodeError):
+        os.remove(f".cache-{username}")
+        token = util.prompt_for_user_token(username, scope)
+
+    spotify_api = spotipy.Spotify(auth=token, requests_session=rate_limiter.session("spotify", retry_methods=SPOTIPY_RETRY_METHODS))
+
+    return spotify_api
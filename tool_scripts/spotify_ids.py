@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+from . import atomic_file
+import functools
+import json
+import os
+import re
+
+
+# user text frame we keep the spotify track id in, in the copy that goes into the library
+SPOTIFY_ID_FRAME = "SPOTIFY_TRACK_ID"
+# optional sidecar next to the downloaded files, {"<file name>": "<spotify track uri or url>"}
+MANIFEST_FILE = ".spotify_manifest.json"
+ID_MAP_FILE = ".jellyfin_spotify_ids.json"
+
+SPOTIFY_ID_RE = re.compile(r"[0-9A-Za-z]{22}")
+# album, playlist and artist uris carry ids of the same shape, only take ids that are marked as tracks
+SPOTIFY_TRACK_RE = re.compile(r"(?:spotify:track:|open\.spotify\.com/(?:intl-[a-z-]+/)?track/)([0-9A-Za-z]{22})")
+# the kind and id of any spotify uri or url, like spotify:playlist:<id> or open.spotify.com/album/<id>?si=...
+SPOTIFY_URI_RE = re.compile(r"(?:spotify:|open\.spotify\.com/(?:intl-[a-z-]+/)?)(track|album|playlist|artist|episode|show)[:/]([0-9A-Za-z]+)")
+
+
+def normalize_spotify_id(value, allow_bare=True):
+    """
+    accepts a spotify:track: uri or an open.spotify.com track url anywhere in value, or, if allow_bare is set,
+    value being nothing but a bare id
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if allow_bare and SPOTIFY_ID_RE.fullmatch(value):
+        return value
+    match = SPOTIFY_TRACK_RE.search(value)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def parse_spotify_uri(value):
+    """returns (kind, id) for a spotify uri or url, like ("playlist", "<id>"), or (None, None)"""
+    match = SPOTIFY_URI_RE.search(value or "")
+    if match is None:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+@functools.lru_cache(maxsize=64)
+def _load_manifest(manifest_path, mtime_ns):
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def manifest_spotify_id(song_file):
+    manifest_path = f"{os.path.dirname(song_file)}/{MANIFEST_FILE}"
+    try:
+        # keyed on mtime so a manifest rewritten by a later download is picked up
+        manifest = _load_manifest(manifest_path, os.stat(manifest_path).st_mtime_ns)
+    except (OSError, ValueError):
+        return None
+    return normalize_spotify_id(manifest.get(os.path.basename(song_file)), allow_bare=False)
+
+
+def record_manifest(song_file, spotify_id):
+    """add song_file to the sidecar manifest in its directory, for downloads where we know which track we asked for"""
+    manifest_path = f"{os.path.dirname(song_file)}/{MANIFEST_FILE}"
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    manifest[os.path.basename(song_file)] = spotify_id
+    with atomic_file.atomic_write(manifest_path) as f:
+        json.dump(manifest, f)
+
+
+def tag_spotify_id(audiofile):
+    tag = audiofile.tag
+    if tag is None:
+        return None
+    for description in (SPOTIFY_ID_FRAME, SPOTIFY_ID_FRAME.lower()):
+        frame = tag.user_text_frames.get(description)
+        if frame is not None:
+            return normalize_spotify_id(frame.text)
+    # some downloaders leave the uri or url in a comment instead
+    for comment in tag.comments:
+        spotify_id = normalize_spotify_id(comment.text, allow_bare=False)
+        if spotify_id:
+            return spotify_id
+    return None
+
+
+def read_spotify_id(audiofile, song_file):
+    """spotify track id for a downloaded file, from its tags or the sidecar manifest, or None"""
+    return tag_spotify_id(audiofile) or manifest_spotify_id(song_file)
+
+
+def write_spotify_id(path, spotify_id):
+    """store the id as a user text frame in the file at path, if it isn't there already"""
+    import eyed3
+    audiofile = eyed3.load(path)
+    if tag_spotify_id(audiofile) == spotify_id:
+        return
+    if audiofile.tag is None:
+        audiofile.initTag()
+    audiofile.tag.user_text_frames.set(spotify_id, SPOTIFY_ID_FRAME)
+    audiofile.tag.save()
+
+
+class SpotifyIdMap:
+    """persistent spotify track id -> jellyfin item id map, kept in the library root"""
+
+    def __init__(self, library_dir):
+        self.path = f"{library_dir}/{ID_MAP_FILE}"
+        self.ids = {}
+        self.dirty = False
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    self.ids = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"unable to load spotify id map {self.path}, starting fresh: {e}")
+
+    def get(self, spotify_id):
+        return self.ids.get(spotify_id)
+
+    def set(self, spotify_id, item_id):
+        if self.ids.get(spotify_id) != item_id:
+            self.ids[spotify_id] = item_id
+            self.dirty = True
+
+    def discard(self, spotify_id):
+        if self.ids.pop(spotify_id, None) is not None:
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        with atomic_file.atomic_write(self.path) as f:
+            json.dump(self.ids, f)
+        self.dirty = False
@@ -1,72 +1,54 @@
 #!/usr/bin/env python3
+from .spotify_api import start_api
 import datetime
-import os
-import sys
-import json
-import spotipy
-import spotipy.util as util
 import re
-import click
-import subprocess
-from json.decoder import JSONDecodeError
-
-
-def start_api(username):
-    """
-    the following must be set:
-    SPOTIPY_CLIENT_ID
-    SPOTIPY_CLIENT_SECRET
-    SPOTIPY_REDIRECT_URI
-    """
-    # check for env vars
-    os.environ["SPOTIPY_CLIENT_ID"]
-    os.environ["SPOTIPY_CLIENT_SECRET"]
-    os.environ["SPOTIPY_REDIRECT_URI"]
-    scope = 'user-read-private user-read-playback-state user-modify-playback-state user-library-read playlist-modify-private playlist-modify-public'
-
-    try:
-        token = util.prompt_for_user_token(username, scope)
-    except (AttributeError, JSONDecodeError):
-        os.remove(f".cache-{username}")
-        token = util.prompt_for_user_token(username, scope)
-
-    spotify_api = spotipy.Spotify(auth=token, retries=10, status_retries=10, backoff_factor=1.5)
-
-    return spotify_api
+
 
 def spotify_time_to_datetime(T_Z_timestring):
     no_z = re.sub('Z', '', T_Z_timestring)
     return datetime.datetime.fromisoformat(no_z).replace(tzinfo=datetime.timezone.utc)
 
+# spotify accepts at most 100 tracks per add, and pages playlists 100 tracks at a time
+TRACK_BATCH_SIZE = 100
+# how many track names to show when logging a batch
+LOG_SAMPLE = 3
+
 def get_new_saved_tracks(spotify_api, timestamp):
-    """return a list of uris for spotify tracks saved after param:timestamp"""
-    new_tracks = []
+    """yield (uri, name) for spotify tracks saved after param:timestamp, newest first"""
     track_limit = 50
     offset = 0
 
     print(f"finding all tracks since {timestamp}")
 
-    def get_tracks():
+    while True:
         num_saved = 0
         saved_tracks = spotify_api.current_user_saved_tracks(limit=track_limit, offset=offset)
         for track in saved_tracks.get("items"):
             if spotify_time_to_datetime(track.get('added_at')) > timestamp:
-                print(f"found {track.get('track').get('name')} at {track.get('added_at')}")
-                new_tracks.append(track.get('track').get('uri'))
                 num_saved +=1
+                yield track.get('track').get('uri'), track.get('track').get('name')
 
-        return num_saved == track_limit
-
-    next = get_tracks()
-    offset +=track_limit
-    # if every track from the last api request matched our filter, request and check the next set
-    while(next):
-        next = get_tracks()
+        # if every track from the last api request matched our filter, request and check the next set
+        if num_saved != track_limit:
+            return
         offset += track_limit
 
-    print(f"found {len(new_tracks)} new tracks")
-
-    return new_tracks
+def playlist_track_uris(spotify_api, playlist_id):
+    """the uri of every track in the playlist, only the uris are requested to keep the pages small"""
+    uris = set()
+    offset = 0
+    while True:
+        page = spotify_api.playlist_items(playlist_id,
+                                          fields="items(track(uri)),next",
+                                          limit=TRACK_BATCH_SIZE,
+                                          offset=offset)
+        for item in page.get("items", []):
+            track = item.get("track") or {}
+            if track.get("uri"):
+                uris.add(track["uri"])
+        if not page.get("next"):
+            return uris
+        offset += TRACK_BATCH_SIZE
 
 def time_now():
     return datetime.datetime.now(datetime.timezone.utc)
@@ -79,7 +61,7 @@ def set_playlist_timestamp(spotify_api, playlist_id):
 
 def get_playlist_timestamp(spotify_api, playlist_id):
     """We keep the last time we checked for new saved songs in the description of the destination playlist"""
-    playlist = spotify_api.playlist(playlist_id)
+    playlist = spotify_api.playlist(playlist_id, fields="description")
     # initialize the playlist description timestamp if it isn't set
     if playlist.get("description") == "":
         print(f"playlist f{playlist_id} does not have a timestamp in its description")
@@ -88,35 +70,47 @@ def get_playlist_timestamp(spotify_api, playlist_id):
     return spotify_time_to_datetime(playlist.get("description"))
 
 
+def add_new_tracks(spotify_api, playlist_id, batch, existing_track_uris):
+    """add one batch of (uri, name) to the playlist, skipping tracks already in it. returns the number added"""
+    non_dup_new_tracks = [(uri, name) for uri, name in batch if uri not in existing_track_uris]
+    if len(non_dup_new_tracks) != len(batch):
+        print(f"skipping {len(batch) - len(non_dup_new_tracks)} tracks already in the playlist")
+    if not non_dup_new_tracks:
+        return 0
+    names = ", ".join(name for _, name in non_dup_new_tracks[:LOG_SAMPLE])
+    if len(non_dup_new_tracks) > LOG_SAMPLE:
+        names += ", ..."
+    print(f"adding {len(non_dup_new_tracks)} non-duplicate new tracks: {names}")
+    spotify_api.playlist_add_items(playlist_id, [uri for uri, _ in non_dup_new_tracks])
+    existing_track_uris.update(uri for uri, _ in non_dup_new_tracks)
+    return len(non_dup_new_tracks)
+
+
 def run(playlist_id, username):
     spotify_api = start_api(username)
     timestamp = get_playlist_timestamp(spotify_api, playlist_id)
-    new_tracks = get_new_saved_tracks(spotify_api, timestamp)
-    if new_tracks:
-        playlist = spotify_api.playlist(playlist_id)
-        # filter out tracks that are already in the playlist so we don't double add them
-        existing_track_uris = {}
-        for track in playlist.get("tracks").get("items"):
-            existing_track_uris[track.get("track").get("uri")] = track.get("track").get("name")
-        print(f"playlist already contains {len(existing_track_uris)} tracks: {existing_track_uris}")
-        non_dup_new_tracks = []
-        for track_uri in new_tracks:
-            if existing_track_uris.get(track_uri, None) is not None:
-                print(f"skipping track {existing_track_uris.get(track_uri)} : {track_uri} as it is already in the playlist")
-            else:
-                non_dup_new_tracks.append(track_uri)
-        print(f"adding {len(non_dup_new_tracks)} non-duplicate new tracks: {non_dup_new_tracks}")
-        spotify_api.playlist_add_items(playlist_id, new_tracks)
+    # filter out tracks that are already in the playlist so we don't double add them
+    existing_track_uris = None
+    found = 0
+    added = 0
+    batch = []
+    # new tracks are added as they are found, a batch at a time, rather than collected up front
+    for track in get_new_saved_tracks(spotify_api, timestamp):
+        if existing_track_uris is None:
+            existing_track_uris = playlist_track_uris(spotify_api, playlist_id)
+            print(f"playlist already contains {len(existing_track_uris)} tracks")
+        found += 1
+        batch.append(track)
+        if len(batch) == TRACK_BATCH_SIZE:
+            added += add_new_tracks(spotify_api, playlist_id, batch, existing_track_uris)
+            batch = []
+    if batch:
+        added += add_new_tracks(spotify_api, playlist_id, batch, existing_track_uris)
+    print(f"found {found} new tracks, added {added}")
 
     set_playlist_timestamp(spotify_api, playlist_id)
 
 
-
-@click.command()
-@click.option("--playlist_id", type=str, required=True, help="playlist uri to record, of the form spotify:playlist:<rand>")
-@click.option("--username", type=str, required=True, help="username of the user to login as")
-def main(playlist_id, username):
-    run(playlist_id=playlist_id, username=username)
-
 if __name__ == "__main__":
-    main()
+    from .cli import spotify_update_playlist
+    spotify_update_playlist()